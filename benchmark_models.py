@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+from manifest import code_version
+from model_daily import daily_admissions_model, daily_switchpoints_model
+from model_deaths import deaths_switchpoints_model
+from model_discrete import delayed_cases
+from model_weekly import weekly_switchpoints_model
+from utils import SPANISH_COLUMNS, build_spanish_cache, read_spanish_cache
+
+
+MODELS = ('daily_admissions', 'daily_switchpoints', 'deaths_switchpoints', 'weekly_switchpoints')
+SIZES = (100, 250, 500, 1000, 2000)
+SWITCHPOINTS = tuple(range(7))
+
+# Delay rates of the synthetic series, in the range the training fits give
+SYNTHETIC_LAMBDA = {'admissions': 0.3, 'deaths': 0.1}
+
+
+def synthetic_series(size, n_switchpoints, seed=0):
+    # Cases in a few waves and admissions/deaths delayed from them, with the
+    # percentage admitted changing at n_switchpoints evenly spread days
+    rng = np.random.default_rng(seed)
+    days = np.arange(size)
+    cases = rng.poisson(2000 * (1.2 + np.sin(2 * np.pi * days / 150)) + 100)
+
+    segment = np.searchsorted(np.linspace(0, size, n_switchpoints + 2)[1:-1], days, side='right')
+    percent = np.linspace(10, 3, n_switchpoints + 1)[segment]
+
+    series = {'cases': cases}
+    for name, lam in SYNTHETIC_LAMBDA.items():
+        mu = np.maximum(delayed_cases(cases * percent / 100, lam), 1e-3)
+        series[name] = rng.negative_binomial(20, 20 / (20 + mu))
+    return series
+
+
+def build_model(kind, series, n_switchpoints):
+    size = len(series['cases'])
+    if kind == 'daily_admissions':
+        model = daily_admissions_model(series['cases'], series['admissions'])
+    elif kind == 'daily_switchpoints':
+        model = daily_switchpoints_model(series['cases'], series['admissions'],
+                                         SYNTHETIC_LAMBDA['admissions'], n_switchpoints)
+    elif kind == 'deaths_switchpoints':
+        model = deaths_switchpoints_model(series['cases'], series['deaths'],
+                                          SYNTHETIC_LAMBDA['deaths'], n_switchpoints)
+    else:
+        weeks = size // 7
+        cases = series['cases'][:weeks * 7].reshape(weeks, 7).sum(axis=1)
+        admissions = series['admissions'][:weeks * 7].reshape(weeks, 7).sum(axis=1)
+        model = weekly_switchpoints_model(cases, np.minimum(admissions, cases), n_switchpoints)
+        size = weeks
+
+    # Starting points inside every window, whatever its length
+    if 'switchpoint' in model.named_vars:
+        lower = 30 if kind == 'daily_switchpoints' else 0
+        model.set_initval(model['switchpoint'], np.linspace(lower, size, n_switchpoints + 2)[1:-1])
+    if 'rate' in model.named_vars and kind != 'weekly_switchpoints':
+        model.set_initval(model['rate'], np.linspace(3, 10, n_switchpoints + 1))
+    return model
+
+
+def benchmark_model(kind, size, n_switchpoints, n_evals=200, draws=0, tune=0, seed=0):
+    series = synthetic_series(size, n_switchpoints, seed)
+
+    start = time.perf_counter()
+    model = build_model(kind, series, n_switchpoints)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    logp = model.compile_logp()
+    dlogp = model.compile_dlogp()
+    compile_time = time.perf_counter() - start
+
+    point = model.initial_point(random_seed=seed)
+    start = time.perf_counter()
+    for _ in range(n_evals):
+        logp(point)
+        dlogp(point)
+    eval_time = time.perf_counter() - start
+
+    row = {
+        'model': kind,
+        'size': size,
+        'n_switchpoints': n_switchpoints,
+        'build_time': build_time,
+        'compile_time': compile_time,
+        'logp_dlogp_per_second': n_evals / eval_time,
+    }
+
+    if draws:
+        start = time.perf_counter()
+        with model:
+            idata = pm.sample(draws=draws, tune=tune, chains=1, cores=1, random_seed=seed,
+                              progressbar=False, compute_convergence_checks=False)
+        row['sample_time'] = time.perf_counter() - start
+        row['draws_per_second'] = (draws + tune) / row['sample_time']
+        row['divergences'] = int(idata.sample_stats['diverging'].sum())
+
+    return row
+
+
+def benchmark_loader(n_provinces=52, size=1000, seed=0):
+    # Builds and reads the Spanish cache from a synthetic source file with the
+    # same layout (province x date x sex x age group rows)
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-01', periods=size).strftime('%Y-%m-%d')
+    index = pd.MultiIndex.from_product([[f'P{idx:02d}' for idx in range(n_provinces)], dates,
+                                        ['H', 'M'], ['0-9', '10-19', '20-29', '30-39', '40-49',
+                                                     '50-59', '60-69', '70-79', '80+']],
+                                       names=['provincia_iso', 'fecha', 'sexo', 'grupo_edad'])
+    data = pd.DataFrame({column: rng.poisson(5, len(index)) for column in SPANISH_COLUMNS + ['num_uci']},
+                        index=index).reset_index()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.csv')
+        cache = os.path.join(directory, 'cache')
+        data.to_csv(source, index=False)
+
+        start = time.perf_counter()
+        build_spanish_cache(source, cache)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, _, tables = read_spanish_cache(cache)
+        np.asarray(tables['num_casos']).sum()
+        read_time = time.perf_counter() - start
+
+    return {'model': 'spanish_loader', 'size': size, 'n_switchpoints': 0,
+            'rows': len(data), 'build_time': build_time, 'read_time': read_time}
+
+
+def compare(current, previous):
+    # Ratio of each timing to the previous run's (> 1 is slower), matched on model, size and K
+    keys = ['model', 'size', 'n_switchpoints']
+    merged = pd.DataFrame(current['results']).merge(pd.DataFrame(previous['results']), on=keys,
+                                                    suffixes=('', '_previous'))
+    table = merged[keys].copy()
+    for column in ('build_time', 'compile_time', 'read_time', 'sample_time'):
+        if column in merged and f'{column}_previous' in merged:
+            table[f'{column}_ratio'] = merged[column] / merged[f'{column}_previous']
+    if 'logp_dlogp_per_second' in merged:
+        table['logp_dlogp_ratio'] = merged['logp_dlogp_per_second_previous'] / merged['logp_dlogp_per_second']
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=str, nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--sizes", type=int, nargs='+', default=list(SIZES))
+    parser.add_argument("-ns", "--n-switchpoints", type=int, nargs='+', default=list(SWITCHPOINTS))
+    parser.add_argument("--evals", type=int, default=200)
+    parser.add_argument("--draws", type=int, default=0, help="Also time a short sampling run")
+    parser.add_argument("--tune", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default='results/benchmark_models.json')
+    parser.add_argument("--compare", type=str, default=None, help="Earlier output to compare with")
+    args = parser.parse_args()
+
+    rows = [benchmark_loader(seed=args.seed)]
+    for kind in args.models:
+        for size in args.sizes:
+            # The training model has no switchpoints
+            for n_switchpoints in ([0] if kind == 'daily_admissions' else args.n_switchpoints):
+                # A failing configuration is reported in its row instead of losing the run
+                try:
+                    rows.append(benchmark_model(kind, size, n_switchpoints, args.evals, args.draws,
+                                                args.tune, args.seed))
+                except Exception as error:
+                    rows.append({'model': kind, 'size': size, 'n_switchpoints': n_switchpoints,
+                                 'error': repr(error)})
+                print(rows[-1])
+
+    report = {
+        'code_version': code_version(),
+        'python': platform.python_version(),
+        'pymc': pm.__version__,
+        'machine': platform.machine(),
+        'results': rows,
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            print(compare(report, json.load(file)).to_string(index=False))
@@ -0,0 +1,65 @@
+import argparse
+import time
+
+import arviz as az
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+from model_daily import daily_switchpoints_model
+from result_store import load_result
+from sampling import SAMPLER_MODULES, available_sampler
+from utils import load_data
+
+
+def benchmark_region(region, sampler, n_switchpoints, draws, tune, chains,
+                     start_date='2020-07-01', end_date='2022-03-27'):
+    posterior = load_result(f'train_daily_{region}', 'posterior', ['admissions_lambda'])
+    admissions_lambda = float(posterior.admissions_lambda.mean())
+
+    cases, hospitalized = load_data(region, start_date, end_date)
+
+    # Wall time includes building and compiling the model, as in a real run
+    start = time.perf_counter()
+    initvals = {'switchpoint': np.linspace(350, 550, n_switchpoints),
+                'rate': np.linspace(3, 10, n_switchpoints + 1)}
+    with daily_switchpoints_model(cases, hospitalized, admissions_lambda, n_switchpoints):
+        idata = pm.sample(draws=draws, tune=tune, chains=chains, target_accept=0.99,
+                          nuts_sampler=sampler, initvals=initvals, progressbar=False)
+    wall_time = time.perf_counter() - start
+
+    ess = az.ess(idata, method='bulk')
+    min_ess = min(float(ess[name].min()) for name in ess.data_vars)
+
+    return {
+        'region': region,
+        'sampler': sampler,
+        'wall_time': wall_time,
+        'min_ess_bulk': min_ess,
+        'ess_per_second': min_ess / wall_time
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=str, nargs='+', required=True)
+    parser.add_argument("--samplers", type=str, nargs='+', default=list(SAMPLER_MODULES),
+                        choices=list(SAMPLER_MODULES))
+    parser.add_argument("-ns", "--n-switchpoints", type=int, default=2)
+    parser.add_argument("--draws", type=int, default=1000)
+    parser.add_argument("--tune", type=int, default=1000)
+    parser.add_argument("--chains", type=int, default=4)
+    parser.add_argument("--output", type=str, default='results/sampler_benchmark.csv')
+    args = parser.parse_args()
+
+    rows = []
+    for sampler in args.samplers:
+        if available_sampler(sampler, args.chains) != sampler:
+            continue
+        for region in args.regions:
+            rows.append(benchmark_region(region, sampler, args.n_switchpoints,
+                                         args.draws, args.tune, args.chains))
+
+    table = pd.DataFrame(rows)
+    table.to_csv(args.output, index=False)
+    print(table.to_string(index=False))
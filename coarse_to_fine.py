@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from train import estimate_daily_switchpoints, estimate_weekly_switchpoints, switchpoint_start
+from train_deaths import estimate_deaths_switchpoints
+from utils import week_labels
+
+
+# Days added around the weekly switchpoints, to the shared bounds and to the
+# width of each switchpoint's pull, to give the daily fit room beyond the
+# weekly resolution
+COARSE_MARGIN = 14
+
+
+def weekly_to_days(switchpoints, start_date, end_date):
+    # Weekly positions (week w ends on week_labels()[w]) to days from start_date,
+    # at the middle of the week
+    first_day = (week_labels(start_date, end_date)[0] - pd.Timestamp(start_date)).days - 3
+    return first_day + 7 * np.asarray(switchpoints)
+
+
+def daily_start(weekly, start_date, end_date, n_switchpoints, lower, margin=COARSE_MARGIN):
+    # Initial values and priors of the daily fit from the weekly posterior. All
+    # switchpoints share (lower, upper) bounds around the weekly 95% intervals,
+    # so the ordering stays that of the days, and each is pulled towards its
+    # weekly median by a Normal as wide as half its weekly interval plus margin
+    # days. K = 0 has only the rate to start from, and keeps the default priors.
+
+    # The weekly rate is the fraction of cases, the daily one a percentage
+    rates = np.sort(weekly.posterior['rate'].median(dim=('chain', 'draw')).to_numpy()) * 100
+    rates = rates + np.arange(n_switchpoints + 1) * 1e-3
+    if n_switchpoints == 0:
+        return {'rate': rates}, None, None
+
+    size = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+    quantiles = weekly.posterior['switchpoint'].quantile((.025, .5, .975), dim=('chain', 'draw')).to_numpy()
+    days = weekly_to_days(quantiles, start_date, end_date)
+    days = days[:, np.argsort(days[1])]
+
+    bounds = (float(max(lower, days[0].min() - margin)), float(min(size, days[2].max() + margin)))
+    switchpoints = np.clip(days[1], bounds[0] + 1, bounds[1] - 2) + np.arange(n_switchpoints) * 1e-2
+    prior = (switchpoints.tolist(), ((days[2] - days[0]) / 2 + margin).tolist())
+    initvals = {'switchpoint': switchpoints, 'rate': rates}
+    return initvals, bounds, prior
+
+
+def coarse_to_fine(region, lam, n_switchpoints, deaths=False, start_date=None, end_date='2022-03-27',
+                   margin=COARSE_MARGIN, n_chains=4, adaptive=None, sampler='pymc', downcast=True,
+                   warm_tune=500, verbose=False, **options):
+    # Weekly fit first; the daily fit then starts in its mode, within narrowed
+    # priors, and only tunes for warm_tune draws
+    start_date = start_date or switchpoint_start(region)
+    lower = 0 if deaths else 30
+    weekly = estimate_weekly_switchpoints(region, start_date, end_date, n_chains=n_chains,
+                                          n_switchpoints=n_switchpoints, adaptive=adaptive,
+                                          sampler=sampler, downcast=downcast, deaths=deaths,
+                                          verbose=verbose)
+    initvals, bounds, prior = daily_start(weekly, start_date, end_date, n_switchpoints, lower, margin)
+
+    # Stored warm starts were adapted to the unnarrowed priors
+    options = dict(options, start_date=start_date, end_date=end_date, n_switchpoints=n_switchpoints,
+                   n_chains=n_chains, adaptive=adaptive, sampler=sampler, downcast=downcast,
+                   verbose=verbose, burn=warm_tune, initvals=initvals, switchpoint_bounds=bounds,
+                   switchpoint_prior=prior, warm_start=False)
+    if deaths:
+        return estimate_deaths_switchpoints(region=region, deaths_lambda=lam, **options)
+    return estimate_daily_switchpoints(region=region, admissions_lambda=lam, **options)
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+from model_daily import daily_switchpoints_model
+from model_deaths import deaths_switchpoints_model
+from result_store import load_result
+from sampling import approximate_posterior
+from utils import load_data
+
+
+def fit_reference(region, method, n_switchpoints, draws, tune, chains, deaths=False,
+                  start_date='2020-07-01', end_date='2022-03-27'):
+    kind = 'deaths' if deaths else 'daily'
+    lambda_name = 'deaths_lambda' if deaths else 'admissions_lambda'
+    lam = float(load_result(f'train_{kind}_{region}', 'posterior', [lambda_name])[lambda_name].mean())
+
+    cases, observed = load_data(region, start_date, end_date, deaths=deaths)
+    build = deaths_switchpoints_model if deaths else daily_switchpoints_model
+    initvals = {'switchpoint': np.linspace(350, 550, n_switchpoints),
+                'rate': np.linspace(3, 10, n_switchpoints + 1)}
+
+    fits = {}
+    start = time.perf_counter()
+    with build(cases, observed, lam, n_switchpoints) as model:
+        fits['nuts'] = pm.sample(draws=draws, tune=tune, chains=chains, initvals=initvals,
+                                 target_accept=0.95 if deaths else 0.99, progressbar=False)
+    times = {'nuts': time.perf_counter() - start}
+
+    start = time.perf_counter()
+    fits[method] = approximate_posterior(build(cases, observed, lam, n_switchpoints), draws * chains,
+                                         method, initvals)
+    times[method] = time.perf_counter() - start
+
+    return fits, times
+
+
+def deviation_report(fits, times, method):
+    # Per parameter: shift of the approximate mean in NUTS standard deviations,
+    # and the ratio of approximate to NUTS standard deviation
+    reference = fits['nuts'].posterior
+    approximate = fits[method].posterior
+    rows = []
+    for name in ('switchpoint', 'rate', 'sigma'):
+        nuts_draws = reference[name].stack(sample=('chain', 'draw'))
+        fast_draws = approximate[name].stack(sample=('chain', 'draw'))
+        nuts_mean, nuts_sd = np.atleast_1d(nuts_draws.mean('sample')), np.atleast_1d(nuts_draws.std('sample'))
+        fast_mean, fast_sd = np.atleast_1d(fast_draws.mean('sample')), np.atleast_1d(fast_draws.std('sample'))
+        for idx in range(len(nuts_mean)):
+            rows.append({
+                'parameter': f'{name}[{idx}]' if len(nuts_mean) > 1 else name,
+                'nuts_mean': nuts_mean[idx],
+                f'{method}_mean': fast_mean[idx],
+                'shift_in_sd': (fast_mean[idx] - nuts_mean[idx]) / nuts_sd[idx],
+                'sd_ratio': fast_sd[idx] / nuts_sd[idx]
+            })
+
+    table = pd.DataFrame(rows)
+    table.attrs['speedup'] = times['nuts'] / times[method]
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--region", type=str, default='MD')
+    parser.add_argument("--method", type=str, default='advi', choices=['advi', 'pathfinder'])
+    parser.add_argument("-ns", "--n-switchpoints", type=int, default=2)
+    parser.add_argument("-d", "--deaths", action='store_true')
+    parser.add_argument("--draws", type=int, default=1000)
+    parser.add_argument("--tune", type=int, default=1000)
+    parser.add_argument("--chains", type=int, default=4)
+    parser.add_argument("--output", type=str, default='results/fast_deviation.csv')
+    args = parser.parse_args()
+
+    fits, times = fit_reference(args.region, args.method, args.n_switchpoints, args.draws,
+                                args.tune, args.chains, args.deaths)
+    table = deviation_report(fits, times, args.method)
+    table.to_csv(args.output, index=False)
+    print(table.to_string(index=False))
+    print(f'NUTS {times["nuts"]:.0f}s, {args.method} {times[args.method]:.0f}s '
+          f'({table.attrs["speedup"]:.1f}x faster)')
@@ -0,0 +1,94 @@
+from functools import lru_cache
+
+import numpy as np
+import pymc as pm
+import pytensor.tensor as pt
+from pytensor.tensor.fft import rfft, irfft
+
+
+DELAY_METHODS = ('matrix', 'conv', 'fft')
+DELAY_TOL = 1e-10
+
+
+@lru_cache(maxsize=32)
+def make_delay_matrix(n_rows, n_columns, first_value):
+    # Cached and shared between models, so it must not be modified in place
+    offset = np.arange(n_columns)[None, :] - np.arange(n_rows)[:, None]
+    matrix = np.where(offset >= 0, offset + first_value, 0)
+    matrix.setflags(write=False)
+    return matrix
+
+
+@lru_cache(maxsize=32)
+def make_shift_index(size, length):
+    # index[k, t] = t - k into an input left-padded with length - 1 zeros
+    index = np.arange(size)[None, :] - np.arange(length)[:, None] + length - 1
+    index.setflags(write=False)
+    return index
+
+
+def cdf_exponential(x, lam):
+    cdf = pm.math.exp(pm.logcdf(pm.Exponential.dist(lam=lam), x))
+    return cdf[..., 1:] - cdf[..., :-1]
+
+
+def kernel_length(lam, size, tol=DELAY_TOL):
+    # Mass of the delay distribution beyond day L is exp(-lam * (L - 0.5)),
+    # so the kernel can be cut once that drops below tol
+    length = int(np.ceil(0.5 - np.log(tol) / lam)) + 1
+    return int(min(size, max(length, 1)))
+
+
+def delay_cases(input_array, parameter_1, size, method='conv', tol=DELAY_TOL, min_lambda=None):
+    if method not in DELAY_METHODS:
+        raise Exception(f'unknown delay method {method}')
+
+    if method == 'matrix':
+        delay_matrix = make_delay_matrix(size, size, 0)
+        probability = cdf_exponential(np.arange(size + 1) - 0.5, parameter_1)
+        matrix = pt.triu(probability[delay_matrix])
+        return pm.math.dot(input_array, matrix)
+
+    # When lambda is a random variable the kernel is truncated using the
+    # smallest value allowed by its prior (the longest possible delay)
+    lam_bound = parameter_1 if min_lambda is None else min_lambda
+    length = kernel_length(float(lam_bound), size, tol)
+    probability = cdf_exponential(np.arange(length + 1) - 0.5, parameter_1)
+
+    if method == 'fft':
+        return fft_convolve(input_array, probability, size, length)
+    return direct_convolve(input_array, probability, size, length)
+
+
+def direct_convolve(input_array, kernel, size, length):
+    padded = pt.concatenate([pt.zeros(length - 1), pt.as_tensor_variable(input_array)])
+    return pm.math.dot(kernel, padded[make_shift_index(size, length)])
+
+
+def delay_regions(input_array, lambdas, size, tol=DELAY_TOL, min_lambda=None):
+    # Direct convolution of an (R, N) input with one delay rate per row, all rows
+    # truncated at the length needed by the slowest one. Random rates need
+    # min_lambda, the smallest value their prior allows.
+    if min_lambda is None:
+        lambdas = np.asarray(lambdas, dtype=float)
+        min_lambda = lambdas.min()
+    length = kernel_length(float(min_lambda), size, tol)
+    kernel = cdf_exponential(np.arange(length + 1) - 0.5, pt.as_tensor_variable(lambdas)[:, None])
+
+    input_array = pt.as_tensor_variable(input_array)
+    padded = pt.concatenate([pt.zeros((input_array.shape[0], length - 1)), input_array], axis=1)
+    return pt.sum(kernel[:, :, None] * padded[:, make_shift_index(size, length)], axis=1)
+
+
+def fft_convolve(input_array, kernel, size, length):
+    n_fft = int(2 ** np.ceil(np.log2(size + length - 1)))
+    signal = pt.concatenate([pt.as_tensor_variable(input_array), pt.zeros(n_fft - size)])
+    kernel = pt.concatenate([kernel, pt.zeros(n_fft - length)])
+
+    signal_f = rfft(signal[None, :])
+    kernel_f = rfft(kernel[None, :])
+    real = signal_f[..., 0] * kernel_f[..., 0] - signal_f[..., 1] * kernel_f[..., 1]
+    imag = signal_f[..., 0] * kernel_f[..., 1] + signal_f[..., 1] * kernel_f[..., 0]
+
+    output = irfft(pt.stack([real, imag], axis=-1))
+    return output[0, :size]
@@ -1,22 +1,20 @@
 #!/bin/bash
 
-# Clear results folder
+# Clear results folder (not needed with --resume: finished stages whose settings,
+# code and data are unchanged are skipped, so a crashed sweep picks up where it stopped)
 #rm -f results/*
 
 # Run baseline switchpoint estimation
 #declare -a array=("AN" "AR" "Belgium" "CL" "CM" "CT" "Czechia" "EX" "France" "GA" "Germany" "IB" "Italy" "MC" "MD" "PV" "Spain" "VC")
 
-#for region in "${array[@]}"
-#do
-#    echo "Running 2 switchpoint estimation for $region"
-#    python3 main.py -r $region -ns 2
-#done
+#python3 main.py --regions "${array[@]}" -ns 2
 
 # Run death estimation
 declare -a array_deaths=("AN" "AR" "CL" "CM" "CT" "EX" "GA" "IB" "MC" "MD" "PV" "Spain" "VC")
 
-for region in "${array_deaths[@]}"
-do
-    echo "Running 2 switchpoint death estimation for $region...\n\n"
-    python3 main.py -r $region -ns 2
-done
+echo "Running 2 switchpoint death estimation for ${array_deaths[@]}...\n\n"
+python3 main.py --regions "${array_deaths[@]}" -ns 2 --resume
+
+# Or, with a worker already running (python3 worker.py), queue it there to skip the
+# import and compile cost:
+#python3 worker.py --submit --wait --regions "${array_deaths[@]}" -ns 2 --resume
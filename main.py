@@ -1,19 +1,193 @@
 import concurrent.futures
-from parser import parse_args
-from train import train_daily_model, estimate_daily_switchpoints
-from train_deaths import train_deaths_model, estimate_deaths_switchpoints
+import multiprocessing
+import os
+import time
+from parser import parse_args, adaptive_settings
+from profiling import run_profile
+
+# The modules below pull in pymc, pytensor, arviz and matplotlib, so each function
+# imports what it uses: parse_args (and --help or a bad argument) answers at once,
+# and a worker (worker.py) pays for them only on its first job.
+
+
+def trained_mean(name, var_name):
+    from result_store import load_result
+    return float(load_result(name, 'posterior', [var_name])[var_name].mean())
+
+
+def sampling_options(args):
+    return {
+        'n_chains': args.chains,
+        'adaptive': adaptive_settings(args),
+        'sampler': args.sampler,
+        'warm_start': args.warm_start or args.incremental,
+        'warm_tune': args.warm_tune,
+        'downcast': args.downcast,
+        'predictive': args.predictive,
+        'predictive_thin': args.predictive_thin,
+        'resume': args.resume
+    }
+
+
+def sensitivity_windows(region, args):
+    from train import switchpoint_start
+    from sensitivity import window_grid
+
+    return window_grid(args.window_starts or [switchpoint_start(region)],
+                       args.window_ends or [args.end_date or '2022-03-27'])
+
+
+def run_region(region, args, reuse_model=False, cores=None):
+    from train import train_daily_model, estimate_daily_switchpoints
+    from train_deaths import train_deaths_model, estimate_deaths_switchpoints
+    from model_selection import select_n_switchpoints
+    from sensitivity import window_sensitivity
+    from coarse_to_fine import coarse_to_fine
+    from result_store import result_path
+    from utils import latest_date
+    from warm_start import seed_warm_start
+
+    cores = args.cores if cores is None else cores
+    with run_profile(f'{region}_{time.strftime("%Y%m%d_%H%M%S")}', args.profile):
+        options = sampling_options(args)
+        estimate_options = dict(options, delay_method=args.delay_method, engine=args.engine,
+                                fast=args.fast)
+        if args.end_date or args.incremental:
+            estimate_options['end_date'] = args.end_date or latest_date(region).strftime('%Y-%m-%d')
+
+        if args.both:
+            return run_both(region, options, estimate_options, args)
+
+        kind = 'deaths' if args.deaths else 'daily'
+        train_name = f'train_{kind}_{region}'
+        if args.incremental:
+            # The training window does not move, so only the switchpoint fit is redone,
+            # starting from the previous one
+            seed_warm_start(f'{kind}_switchpoints', region, args.n_switchpoints,
+                            f'switchpoints_{kind}_{args.n_switchpoints}_{region}')
+
+        if not args.deaths:
+            # Hospitalization
+            if args.incremental and os.path.exists(result_path(train_name)):
+                admissions_lambda = trained_mean(train_name, 'admissions_lambda')
+            else:
+                pH, admissions_lambda = train_daily_model(region, verbose=True, reuse_model=reuse_model,
+                                                           **options)
+                print(f' pH es {pH}, admissions_lambda es {admissions_lambda}\n')
+            if args.window_starts or args.window_ends:
+                window_sensitivity(region, admissions_lambda, args.n_switchpoints,
+                                   sensitivity_windows(region, args),
+                                   n_workers=max(1, cores // args.chains), reuse_model=reuse_model,
+                                   **estimate_options)
+            elif args.select_k:
+                select_n_switchpoints(region, admissions_lambda, args.n_switchpoints,
+                                      n_workers=max(1, cores // args.chains), profile=args.profile,
+                                      **estimate_options)
+            elif args.weekly_model:
+                coarse_to_fine(region, admissions_lambda, args.n_switchpoints, verbose=True,
+                               reuse_model=reuse_model, **estimate_options)
+            else:
+                estimate_daily_switchpoints(region=region, admissions_lambda=admissions_lambda,
+                                            n_switchpoints=args.n_switchpoints, verbose=True,
+                                            reuse_model=reuse_model, **estimate_options)
+        else:
+            # Deaths
+            if args.incremental and os.path.exists(result_path(train_name)):
+                deaths_lambda = trained_mean(train_name, 'deaths_lambda')
+            else:
+                pD, deaths_lambda = train_deaths_model(region, reuse_model=reuse_model, **options)
+            if args.window_starts or args.window_ends:
+                window_sensitivity(region, deaths_lambda, args.n_switchpoints,
+                                   sensitivity_windows(region, args), deaths=True,
+                                   n_workers=max(1, cores // args.chains), reuse_model=reuse_model,
+                                   **estimate_options)
+            elif args.select_k:
+                select_n_switchpoints(region, deaths_lambda, args.n_switchpoints, deaths=True,
+                                      n_workers=max(1, cores // args.chains), profile=args.profile,
+                                      **estimate_options)
+            elif args.weekly_model:
+                coarse_to_fine(region, deaths_lambda, args.n_switchpoints, deaths=True,
+                               reuse_model=reuse_model, **estimate_options)
+            else:
+                estimate_deaths_switchpoints(region=region, deaths_lambda=deaths_lambda,
+                                             n_switchpoints=args.n_switchpoints,
+                                             reuse_model=reuse_model, **estimate_options)
+
+        return region
+
+
+def run_both(region, options, estimate_options, args):
+    from train_joint import train_joint_model, estimate_joint_switchpoints
+
+    # Admissions and deaths observed against the same cases: one training run and
+    # one switchpoint run instead of two of each
+    options = {key: options[key] for key in ('n_chains', 'adaptive', 'sampler', 'downcast',
+                                             'predictive', 'predictive_thin', 'resume')}
+    pH, pD, admissions_lambda, deaths_lambda = train_joint_model(region, verbose=True, **options)
+    print(f' pH es {pH}, admissions_lambda es {admissions_lambda}\n')
+    print(f' pD es {pD}, deaths_lambda es {deaths_lambda}\n')
+
+    if 'end_date' in estimate_options:
+        options['end_date'] = estimate_options['end_date']
+    estimate_joint_switchpoints(region, admissions_lambda, deaths_lambda,
+                                n_switchpoints=args.n_switchpoints, verbose=True, fast=args.fast,
+                                **options)
+
+    return region
+
+
+def run_joint(regions, args):
+    from train import train_daily_model
+    from train_deaths import train_deaths_model
+    from train_hierarchical import estimate_hierarchical_switchpoints
+    from result_store import result_path
+
+    # Training stays per region (reusing stored fits); the switchpoints of all
+    # regions are then estimated in a single hierarchical fit
+    options = sampling_options(args)
+    kind = 'deaths' if args.deaths else 'daily'
+    lambda_name = 'deaths_lambda' if args.deaths else 'admissions_lambda'
+
+    lambdas = []
+    for region in regions:
+        train_name = f'train_{kind}_{region}'
+        if not os.path.exists(result_path(train_name)):
+            if args.deaths:
+                train_deaths_model(region, reuse_model=True, **options)
+            else:
+                train_daily_model(region, reuse_model=True, **options)
+        lambdas.append(trained_mean(train_name, lambda_name))
+
+    estimate_hierarchical_switchpoints(regions, lambdas, n_switchpoints=args.n_switchpoints,
+                                       deaths=args.deaths, verbose=True, n_chains=args.chains,
+                                       adaptive=options['adaptive'], sampler=args.sampler,
+                                       downcast=args.downcast, predictive=args.predictive,
+                                       predictive_thin=args.predictive_thin)
+
+
+def run_sweep(regions, args):
+    # Each region runs its train and estimate stages in order on one worker,
+    # and every worker samples args.chains chains in parallel. Workers keep their
+    # compiled models, so regions with the same window length only swap data
+    n_workers = max(1, min(len(regions), args.cores // args.chains))
+    cores = max(args.chains, args.cores // n_workers)
+    context = multiprocessing.get_context('spawn')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        futures = {executor.submit(run_region, region, args, True, cores): region for region in regions}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                print(f'Finished {future.result()}')
+            except Exception as error:
+                print(f'Region {futures[future]} failed: {error}')
+
 
 if __name__ == "__main__":
     args = parse_args()
 
-    if not args.deaths:
-        # Hospitalization
-        pH, admissions_lambda = train_daily_model(args.region, verbose=True)
-        print(f' pH es {pH}, admissions_lambda es {admissions_lambda}\n')
-        estimate_daily_switchpoints(region=args.region, admissions_lambda=admissions_lambda,
-                                    n_switchpoints=args.n_switchpoints,verbose=True)
+    if args.joint:
+        run_joint(args.regions or [args.region], args)
+    elif args.regions:
+        run_sweep(args.regions, args)
     else:
-        # Deaths
-        pD, deaths_lambda = train_deaths_model(args.region)
-        estimate_deaths_switchpoints(region=args.region, deaths_lambda=deaths_lambda,
-                                     n_switchpoints=args.n_switchpoints)
\ No newline at end of file
+        run_region(args.region, args)
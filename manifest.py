@@ -0,0 +1,96 @@
+import glob
+import hashlib
+import json
+import os
+import resource
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from result_store import result_path
+
+
+# One small JSON file per finished stage, named by the stage key, so parallel
+# sweep workers never write to the same file
+MANIFEST_DIR = 'results/manifest'
+
+
+@lru_cache(maxsize=1)
+def code_version():
+    # Hash of the Python sources next to this file: any change to the models or
+    # the sampling code invalidates earlier results
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def data_hash(inputs):
+    digest = hashlib.sha1()
+    for array in inputs:
+        digest.update(np.ascontiguousarray(np.asarray(array, dtype=float)).tobytes())
+    return digest.hexdigest()
+
+
+def output_stamp(path):
+    # Size and modification time of a stored result: the result file is named
+    # after the fit, not its settings, so a later run with other settings
+    # overwrites it and no longer matches this stage's entry
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class ManifestStage:
+    # A train_*/estimate_* run of one region: skipped when a run with the same
+    # settings, code and input data already stored its result, otherwise timed
+    # and recorded once it finishes
+
+    def __init__(self, stage, region, settings, inputs, name):
+        self.name = name
+        self.entry = {
+            'stage': stage,
+            'region': region,
+            'settings': settings,
+            'code_version': code_version(),
+            'data_hash': data_hash(inputs),
+        }
+        self.key = hashlib.sha1(json.dumps(self.entry, sort_keys=True, default=str).encode()).hexdigest()
+        self.path = os.path.join(MANIFEST_DIR, f'{self.key}.json')
+        self.start_time = None
+
+    def done(self):
+        if not (os.path.exists(self.path) and os.path.exists(result_path(self.name))):
+            return False
+        with open(self.path) as file:
+            stamp = json.load(file).get('output_stamp')
+        if stamp != output_stamp(result_path(self.name)):
+            return False
+        print(f'{self.entry["stage"]} {self.entry["region"]}: already computed in {result_path(self.name)}')
+        return True
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def finish(self):
+        entry = dict(self.entry, output=result_path(self.name),
+                     output_stamp=output_stamp(result_path(self.name)),
+                     wall_time=time.perf_counter() - self.start_time,
+                     # ru_maxrss is in KiB on Linux: the process peak by the end of the stage
+                     peak_memory_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                     finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(entry, file, indent=1, default=str)
+        os.replace(tmp_path, self.path)
+
+
+def read_manifest():
+    entries = []
+    for path in sorted(glob.glob(os.path.join(MANIFEST_DIR, '*.json'))):
+        with open(path) as file:
+            entries.append(json.load(file))
+    return entries
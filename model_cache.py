@@ -0,0 +1,58 @@
+import numpy as np
+import pymc as pm
+
+from model_daily import daily_admissions_model, daily_switchpoints_model
+from model_deaths import daily_deaths_model, deaths_switchpoints_model
+
+
+# Smallest delay rate allowed by the training priors, so a reused switchpoint
+# model truncates its delay kernel in a way that is valid for every region
+MIN_LAMBDA = 0.1
+
+# Models and NUTS steps compiled in this process, keyed by
+# (model type, series length, n_switchpoints, delay method, target_accept). Sweep workers
+# run several regions one after another and only swap their data in.
+COMPILED_MODELS = {}
+
+
+def build_model(kind, cases, observed, n_switchpoints, lam, delay_method):
+    if kind == 'daily_admissions':
+        return daily_admissions_model(cases, observed, delay_method=delay_method)
+    if kind == 'daily_deaths':
+        return daily_deaths_model(cases, observed, delay_method=delay_method)
+    if kind == 'daily_switchpoints':
+        return daily_switchpoints_model(cases, observed, lam, n_switchpoints,
+                                        delay_method=delay_method, min_lambda=MIN_LAMBDA)
+    if kind == 'deaths_switchpoints':
+        return deaths_switchpoints_model(cases, observed, lam, n_switchpoints,
+                                         delay_method=delay_method, min_lambda=MIN_LAMBDA)
+    raise Exception(f'unknown model {kind}')
+
+
+def model_data(kind, cases, observed, lam):
+    observed_name = 'observed_deaths' if 'deaths' in kind else 'observed_admissions'
+    data = {
+        'cases': np.asarray(cases, dtype=float),
+        observed_name: np.asarray(observed).astype('int64'),
+    }
+    if kind.endswith('switchpoints'):
+        lambda_name = 'deaths_lambda' if 'deaths' in kind else 'admissions_lambda'
+        data[lambda_name] = float(lam)
+    return data
+
+
+def cached_model(kind, cases, observed, n_switchpoints=0, lam=None, delay_method='conv',
+                 target_accept=0.8):
+    key = (kind, len(cases), n_switchpoints, delay_method, target_accept)
+
+    if key not in COMPILED_MODELS:
+        model = build_model(kind, cases, observed, n_switchpoints, lam, delay_method)
+        with model:
+            step = pm.NUTS(target_accept=target_accept)
+        COMPILED_MODELS[key] = (model, step)
+
+    model, step = COMPILED_MODELS[key]
+    with model:
+        pm.set_data(model_data(kind, cases, observed, lam))
+
+    return model, step
@@ -1,13 +1,19 @@
 import numpy as np
 import pymc as pm
-import pytensor
 
+from delays import delay_cases
+from switchpoints import build_switch, switchpoint_initval
 
-def daily_admissions_model(cases, observed_admissions):
 
-    delay_matrix_0 = make_delay_matrix(len(cases), len(cases), 0)
+def daily_admissions_model(cases, observed_admissions, delay_method='conv'):
+
+    size = len(cases)
 
     with pm.Model() as model:
+        # data, kept in shared containers so a compiled model can be reused with pm.set_data
+        cases = pm.Data('cases', np.asarray(cases, dtype=float))
+        observed_admissions = pm.Data('observed_admissions', np.asarray(observed_admissions).astype('int64'))
+
         # priors
         ph = pm.Uniform(name='pH', lower=0, upper=1)
         admissions_lambda = pm.Uniform(name='admissions_lambda', lower=0.1, upper=20)
@@ -15,59 +21,58 @@ def daily_admissions_model(cases, observed_admissions):
 
         # trainning
         new_hospitalized = ph * cases
-        admissions = delay_cases(new_hospitalized, admissions_lambda, delay_matrix_0)
+        admissions = delay_cases(new_hospitalized, admissions_lambda, size,
+                                 method=delay_method, min_lambda=0.1)
         pm.NegativeBinomial(name='admissions', mu=admissions, alpha=sigma,
                             observed=observed_admissions)
 
     return model
 
 
-def make_delay_matrix(n_rows, n_columns, first_value):
-    size = max(n_rows, n_columns)
-    matrix = np.zeros((size, size))
-    for i in range(size):
-        diagonal = np.ones(size - i) * (first_value + i)
-        matrix += np.diag(diagonal, i)
-    return matrix[:n_rows, :n_columns].astype(int)
-
-
-def delay_cases(input_array, parameter_1, delay_matrix):
-    probability = cdf_exponential(np.arange(delay_matrix.shape[0] + 1) - 0.5, parameter_1)
-    matrix = pytensor.tensor.triu(probability[delay_matrix])
-    return pm.math.dot(input_array, matrix)
-
+def daily_switchpoints_model(cases, observed_admissions, admissions_lambda, n_switchpoints,
+                             delay_method='conv', min_lambda=None, switchpoint_bounds=None,
+                             switchpoint_prior=None):
 
-def cdf_exponential(x, lam):
-    cdf = pm.math.exp(pm.logcdf(pm.Exponential.dist(lam=lam), x))
-    return cdf[1:] - cdf[:-1]
-
-
-def daily_switchpoints_model(cases, observed_admissions, admissions_lambda, n_switchpoints):
-
-    delay_matrix_0 = make_delay_matrix(len(cases), len(cases), 0)
+    size = len(cases)
+    min_lambda = admissions_lambda if min_lambda is None else min_lambda
+    # (lower, upper) days shared by all switchpoints: per-switchpoint bounds would
+    # be ordered on their own interval scales, not as days. Narrowing around a
+    # weekly fit is a (centre, scale) Normal pull on each switchpoint instead.
+    lower, upper = switchpoint_bounds if switchpoint_bounds is not None else (30, size)
 
     with pm.Model() as model:
-
-        def build_switch():
-            value = rates[n_switchpoints]
-            for idx in range(0, n_switchpoints):
-                weight = pm.math.sigmoid(2 * (points - switchpoints[idx]))
-                value = weight * rates[n_switchpoints - idx - 1] + (1 - weight) * value
-            return value/100
-
-        points = np.arange(0, len(cases))
-        switchpoints = pm.Uniform('switchpoint', lower=30, upper=len(points), shape=(n_switchpoints,),
-                                  transform=pm.distributions.transforms.Ordered())
+        # data, kept in shared containers so a compiled model can be reused with pm.set_data
+        cases = pm.Data('cases', np.asarray(cases, dtype=float))
+        observed_admissions = pm.Data('observed_admissions', np.asarray(observed_admissions).astype('int64'))
+        admissions_lambda = pm.Data('admissions_lambda', float(admissions_lambda))
+
+        points = np.arange(0, size)
+        # K = 0 is a single rate for the whole series (the Ordered transform
+        # cannot take an empty vector)
+        switchpoints = None
+        if n_switchpoints > 0:
+            # Starting values in the model itself, not only in pm.sample's initvals
+            # (nutpie ignores those): equal support points are log(0) once ordered
+            switchpoints = pm.Uniform('switchpoint', lower=lower, upper=upper, shape=(n_switchpoints,),
+                                      transform=pm.distributions.transforms.Ordered(),
+                                      initval=switchpoint_initval(n_switchpoints, lower, upper))
+            if switchpoint_prior is not None:
+                centre, scale = switchpoint_prior
+                pm.Potential('switchpoint_prior',
+                             pm.logp(pm.Normal.dist(mu=np.asarray(centre), sigma=np.asarray(scale)),
+                                     switchpoints).sum())
         rates = pm.Gamma('rate', alpha=7.5, beta=1.0, shape=(n_switchpoints+1,),
-                          transform=pm.distributions.transforms.Ordered())
+                          transform=pm.distributions.transforms.Ordered(),
+                          initval=np.array(np.linspace(3, 10, n_switchpoints + 1)))
         #pm.Uniform('rate', lower=0, upper=1, shape=(n_switchpoints+1,))
 
-        rate = build_switch()
+        rate = build_switch(points, switchpoints, rates, n_switchpoints) / 100
         sigma = pm.Uniform(name='sigma', lower=1, upper=100)
 
         # trainning
         new_hospitalized = rate * cases
-        admissions = delay_cases(new_hospitalized, admissions_lambda, delay_matrix_0)
+        admissions = delay_cases(new_hospitalized, admissions_lambda, size,
+                                 method=delay_method, min_lambda=min_lambda)
         pm.NegativeBinomial(name='admissions', mu=admissions, alpha=sigma,
                             observed=observed_admissions)
 
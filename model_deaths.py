@@ -1,13 +1,19 @@
 import numpy as np
 import pymc as pm
-import pytensor
 
+from delays import delay_cases
+from switchpoints import build_switch, switchpoint_initval
 
-def daily_deaths_model(cases, observed_deaths):
 
-    delay_matrix_0 = make_delay_matrix(len(cases), len(cases), 0)
+def daily_deaths_model(cases, observed_deaths, delay_method='conv'):
+
+    size = len(cases)
 
     with pm.Model() as model:
+        # data, kept in shared containers so a compiled model can be reused with pm.set_data
+        cases = pm.Data('cases', np.asarray(cases, dtype=float))
+        observed_deaths = pm.Data('observed_deaths', np.asarray(observed_deaths).astype('int64'))
+
         # priors
         pD = pm.Uniform(name='pD', lower=0, upper=1)
         deaths_lambda = pm.Uniform(name='deaths_lambda', lower=0.1, upper=20)
@@ -15,61 +21,56 @@ def daily_deaths_model(cases, observed_deaths):
 
         # trainning
         new_deaths = pD * cases
-        deaths = delay_cases(new_deaths, deaths_lambda, delay_matrix_0)
+        deaths = delay_cases(new_deaths, deaths_lambda, size,
+                             method=delay_method, min_lambda=0.1)
         pm.NegativeBinomial(name='deaths', mu=deaths, alpha=sigma,
                             observed=observed_deaths)
 
     return model
 
 
-def make_delay_matrix(n_rows, n_columns, first_value):
-    size = max(n_rows, n_columns)
-    matrix = np.zeros((size, size))
-    for i in range(size):
-        diagonal = np.ones(size - i) * (first_value + i)
-        matrix += np.diag(diagonal, i)
-    return matrix[:n_rows, :n_columns].astype(int)
-
-
-def delay_cases(input_array, parameter_1, delay_matrix):
-    probability = cdf_exponential(np.arange(delay_matrix.shape[0] + 1) - 0.5, parameter_1)
-    matrix = pytensor.tensor.triu(probability[delay_matrix])
-    return pm.math.dot(input_array, matrix)
-
+def deaths_switchpoints_model(cases, observed_deaths, deaths_lambda, n_switchpoints,
+                              delay_method='conv', min_lambda=None, switchpoint_bounds=None,
+                              switchpoint_prior=None):
 
-def cdf_exponential(x, lam):
-    cdf = pm.math.exp(pm.logcdf(pm.Exponential.dist(lam=lam), x))
-    return cdf[1:] - cdf[:-1]
-
-
-def deaths_switchpoints_model(cases, observed_deaths, deaths_lambda, n_switchpoints):
-
-    delay_matrix_0 = make_delay_matrix(len(cases), len(cases), 0)
+    size = len(cases)
+    min_lambda = deaths_lambda if min_lambda is None else min_lambda
+    # (lower, upper) days shared by all switchpoints: per-switchpoint bounds would
+    # be ordered on their own interval scales, not as days. Narrowing around a
+    # weekly fit is a (centre, scale) Normal pull on each switchpoint instead.
+    lower, upper = switchpoint_bounds if switchpoint_bounds is not None else (0, size)
 
     with pm.Model() as model:
-
-        def build_switch():
-            value = rates[n_switchpoints]
-            for idx in range(0, n_switchpoints):
-                weight = pm.math.sigmoid(2 * (points - switchpoints[idx]))
-                value = weight * rates[n_switchpoints - idx - 1] + (1 - weight) * value
-            return value/100
-
-        points = np.arange(0, len(cases))
-        switchpoints = pm.Uniform('switchpoint', lower=0, upper=len(points), shape=(n_switchpoints,),
-                                  transform=pm.distributions.transforms.univariate_ordered,
-                                  initval=np.array(np.linspace(350, 550, n_switchpoints)))
+        # data, kept in shared containers so a compiled model can be reused with pm.set_data
+        cases = pm.Data('cases', np.asarray(cases, dtype=float))
+        observed_deaths = pm.Data('observed_deaths', np.asarray(observed_deaths).astype('int64'))
+        deaths_lambda = pm.Data('deaths_lambda', float(deaths_lambda))
+
+        points = np.arange(0, size)
+        # K = 0 is a single rate for the whole series (the Ordered transform
+        # cannot take an empty vector)
+        switchpoints = None
+        if n_switchpoints > 0:
+            switchpoints = pm.Uniform('switchpoint', lower=lower, upper=upper, shape=(n_switchpoints,),
+                                      transform=pm.distributions.transforms.univariate_ordered,
+                                      initval=switchpoint_initval(n_switchpoints, lower, upper))
+            if switchpoint_prior is not None:
+                centre, scale = switchpoint_prior
+                pm.Potential('switchpoint_prior',
+                             pm.logp(pm.Normal.dist(mu=np.asarray(centre), sigma=np.asarray(scale)),
+                                     switchpoints).sum())
         rates = pm.Gamma('rate', alpha=7.5, beta=1.0, shape=(n_switchpoints+1,),
                          transform=pm.distributions.transforms.univariate_ordered,
                          initval=np.array(np.linspace(3, 10, n_switchpoints + 1)))
         #pm.Uniform('rate', lower=0, upper=1, shape=(n_switchpoints+1,))
 
-        rate = build_switch()
+        rate = build_switch(points, switchpoints, rates, n_switchpoints) / 100
         sigma = pm.Uniform(name='sigma', lower=1, upper=100)
 
         # trainning
         new_deaths = rate * cases
-        deaths = delay_cases(new_deaths, deaths_lambda, delay_matrix_0)
+        deaths = delay_cases(new_deaths, deaths_lambda, size,
+                             method=delay_method, min_lambda=min_lambda)
         pm.NegativeBinomial(name='deaths', mu=deaths, alpha=sigma,
                             observed=observed_deaths)
 
@@ -0,0 +1,154 @@
+import numpy as np
+import pymc as pm
+import pytensor
+import pytensor.tensor as pt
+import xarray as xr
+from scipy.special import gammaln, logsumexp, xlogy
+
+from delays import DELAY_TOL, kernel_length
+
+
+# Switchpoints are integer days: the first day of each new segment. The rate
+# switches on the admission (or death) side, i.e. it multiplies the already
+# delayed cases, which is what makes the segments independent given their
+# boundaries and lets them be summed out exactly.
+
+
+def delayed_cases(cases, lam, tol=DELAY_TOL):
+    cases = np.asarray(cases, dtype=float)
+    length = kernel_length(lam, len(cases), tol)
+    days = np.arange(length)
+    kernel = np.exp(-lam * np.maximum(days - 0.5, 0)) - np.exp(-lam * (days + 0.5))
+    return np.convolve(cases, kernel)[:len(cases)]
+
+
+def switchpoint_bounds(size, n_switchpoints, lower):
+    # Every segment keeps at least one day
+    lower = max(lower, 1)
+    upper = size - n_switchpoints
+    if upper < lower:
+        raise Exception('series too short for the number of switchpoints')
+    return lower, upper
+
+
+def logaddexp(a, b):
+    top = pt.maximum(a, b)
+    return top + pt.log1p(pt.exp(-abs(a - b)))
+
+
+def logcumsumexp(x):
+    values, _ = pytensor.scan(logaddexp, sequences=x[1:], outputs_info=x[0])
+    return pt.concatenate([x[:1], values])
+
+
+def marginal_loglik(loglik, size, n_switchpoints, lower):
+    # loglik[k, t]: log-likelihood of day t if it belongs to segment k (in time order).
+    # forward[j] sums over all earlier switchpoints given switchpoint k at day lower + k - 1 + j
+    cumulative = pt.concatenate([pt.zeros((n_switchpoints + 1, 1)), pt.cumsum(loglik, axis=1)], axis=1)
+    if n_switchpoints == 0:
+        return cumulative[0, size]
+
+    lower, upper = switchpoint_bounds(size, n_switchpoints, lower)
+    forward = cumulative[0, lower:upper + 1]
+    for k in range(1, n_switchpoints):
+        forward = (cumulative[k, lower + k:upper + k + 1]
+                   + logcumsumexp(forward - cumulative[k, lower + k - 1:upper + k]))
+
+    last = n_switchpoints
+    return pm.math.logsumexp(forward + cumulative[last, size]
+                             - cumulative[last, lower + last - 1:upper + last])
+
+
+def discrete_switchpoints_model(cases, observed, lam, n_switchpoints, lower=30):
+    delayed = delayed_cases(cases, lam)
+    observed = np.asarray(observed).astype('int64')
+    size = len(delayed)
+
+    with pm.Model() as model:
+        rates = pm.Gamma('rate', alpha=7.5, beta=1.0, shape=(n_switchpoints+1,),
+                         transform=pm.distributions.transforms.Ordered())
+        sigma = pm.Uniform(name='sigma', lower=1, upper=100)
+
+        # segment k in time uses rate[K - k], as in the sigmoid models
+        mu = rates[::-1][:, None] * delayed[None, :] / 100
+        loglik = pm.logp(pm.NegativeBinomial.dist(mu=mu, alpha=sigma), observed[None, :])
+        pm.Potential('switchpoints_marginal', marginal_loglik(loglik, size, n_switchpoints, lower))
+
+    return model
+
+
+def nb_logpmf(y, mu, alpha):
+    return (gammaln(y + alpha) - gammaln(alpha) - gammaln(y + 1)
+            + alpha * np.log(alpha / (alpha + mu)) + xlogy(y, mu / (alpha + mu)))
+
+
+def draw_switchpoints(loglik, n_switchpoints, lower, rng):
+    # Forward pass as in marginal_loglik, then sample the switchpoints backwards
+    size = loglik.shape[1]
+    cumulative = np.concatenate([np.zeros((n_switchpoints + 1, 1)), np.cumsum(loglik, axis=1)], axis=1)
+    lower, upper = switchpoint_bounds(size, n_switchpoints, lower)
+
+    forwards = [cumulative[0, lower:upper + 1]]
+    for k in range(1, n_switchpoints):
+        forwards.append(cumulative[k, lower + k:upper + k + 1]
+                        + np.logaddexp.accumulate(forwards[-1] - cumulative[k, lower + k - 1:upper + k]))
+
+    switchpoints = np.zeros(n_switchpoints, dtype=int)
+    end = size
+    for k in range(n_switchpoints, 0, -1):
+        first = lower + k - 1
+        forward = forwards[k - 1][:end - first]
+        logits = forward + cumulative[k, end] - cumulative[k, first:end]
+        probability = np.exp(logits - logsumexp(logits))
+        end = first + rng.choice(len(probability), p=probability / probability.sum())
+        switchpoints[k - 1] = end
+
+    return switchpoints
+
+
+def sample_discrete_switchpoints(cases, observed, lam, n_switchpoints, name, lower=30,
+                                 draws=5000, tune=2000, chains=4, target_accept=0.9, seed=None,
+                                 **kwargs):
+    delayed = delayed_cases(cases, lam)
+    observed = np.asarray(observed).astype('int64')
+    size = len(delayed)
+
+    with discrete_switchpoints_model(cases, observed, lam, n_switchpoints, lower):
+        idata = pm.sample(draws=draws, tune=tune, chains=chains, target_accept=target_accept,
+                          initvals={'rate': np.array(np.linspace(3, 10, n_switchpoints + 1))},
+                          random_seed=seed, **kwargs)
+
+    # Exact draws of the switchpoints given each posterior draw of the rates and sigma
+    rng = np.random.default_rng(seed)
+    rates = idata.posterior['rate'].to_numpy()
+    sigmas = idata.posterior['sigma'].to_numpy()
+    switchpoints = np.zeros(rates.shape[:2] + (n_switchpoints,))
+    predictive = np.zeros(rates.shape[:2] + (size,), dtype='int64')
+    pointwise = np.zeros(rates.shape[:2] + (size,))
+
+    for chain in range(rates.shape[0]):
+        for draw in range(rates.shape[1]):
+            mu = rates[chain, draw, ::-1, None] * delayed[None, :] / 100
+            loglik = nb_logpmf(observed[None, :], mu, sigmas[chain, draw])
+            points = draw_switchpoints(loglik, n_switchpoints, lower, rng)
+
+            segment = np.searchsorted(points, np.arange(size), side='right')
+            switchpoints[chain, draw] = points
+            pointwise[chain, draw] = loglik[segment, np.arange(size)]
+
+            day_mu = mu[segment, np.arange(size)]
+            alpha = sigmas[chain, draw]
+            predictive[chain, draw] = rng.negative_binomial(alpha, alpha / (alpha + day_mu))
+
+    dims = ('chain', 'draw', f'{name}_dim_0')
+    coords = {'chain': idata.posterior.chain, 'draw': idata.posterior.draw}
+    if n_switchpoints > 0:
+        # As the K = 0 NUTS models, no switchpoint variable rather than an empty one
+        idata.posterior['switchpoint'] = (('chain', 'draw', 'switchpoint_dim_0'), switchpoints)
+    idata.add_groups(
+        posterior_predictive=xr.Dataset({name: (dims, predictive)}, coords=coords),
+        log_likelihood=xr.Dataset({name: (dims, pointwise)}, coords=coords),
+        observed_data=xr.Dataset({name: ((f'{name}_dim_0',), observed)}),
+    )
+
+    return idata
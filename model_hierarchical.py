@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pymc as pm
+import pytensor.tensor as pt
+
+from delays import delay_regions
+from switchpoints import build_switch
+from utils import load_data
+
+
+# Regions whose windows start later than the common one; earlier days are masked
+REGION_START = {'Italy': '2020-09-01'}
+
+
+def load_regions(regions, start_date, end_date, deaths=False):
+    # (R, N) cases and observations on a common daily grid; days a region has no
+    # data for are zero in both and False in the mask
+    dates = pd.date_range(start_date, end_date)
+    cases = np.zeros((len(regions), len(dates)))
+    observed = np.zeros((len(regions), len(dates)), dtype='int64')
+    mask = np.zeros((len(regions), len(dates)), dtype=bool)
+
+    for idx, region in enumerate(regions):
+        region_start = max(pd.Timestamp(start_date), pd.Timestamp(REGION_START.get(region, start_date)))
+        region_cases, region_observed = load_data(region, region_start, end_date, deaths=deaths)
+        region_cases = region_cases.reindex(dates).to_numpy(dtype=float)
+        region_observed = region_observed.reindex(dates).to_numpy(dtype=float)
+
+        mask[idx] = np.isfinite(region_cases) & np.isfinite(region_observed)
+        cases[idx] = np.where(mask[idx], region_cases, 0)
+        observed[idx] = np.where(mask[idx], np.round(region_observed), 0)
+
+    return cases, observed, mask
+
+
+def hierarchical_switchpoints_model(regions, cases, observed, mask, lambdas, n_switchpoints,
+                                    name='admissions', lower=30):
+    # Switchpoints and log-rates of every region are drawn around shared means, so
+    # regions with few or noisy observations are pulled towards the others
+    n_regions, size = cases.shape
+    region_index, day_index = np.nonzero(mask)
+    coords = {'region': list(regions), 'day': np.arange(size),
+              'segment': np.arange(n_switchpoints + 1), 'switch': np.arange(n_switchpoints)}
+
+    with pm.Model(coords=coords) as model:
+        cases = pm.Data('cases', cases, dims=('region', 'day'))
+        observed = pm.Data(f'observed_{name}', observed[mask])
+
+        points = np.arange(0, size)
+        if n_switchpoints > 0:
+            switchpoint_mu = pm.Uniform('switchpoint_mu', lower=lower, upper=size, dims='switch',
+                                        transform=pm.distributions.transforms.univariate_ordered,
+                                        initval=np.linspace(350, 550, n_switchpoints))
+            switchpoint_sigma = pm.HalfNormal('switchpoint_sigma', sigma=60)
+            switchpoints = pm.Normal('switchpoint', mu=switchpoint_mu, sigma=switchpoint_sigma,
+                                     dims=('region', 'switch'),
+                                     transform=pm.distributions.transforms.univariate_ordered,
+                                     initval=np.tile(np.linspace(350, 550, n_switchpoints), (n_regions, 1)))
+        else:
+            switchpoints = pt.zeros((n_regions, 0))
+
+        # Gamma(7.5, 1) of the single-region models has its mean at log(7.5) ~ 2
+        log_rate_mu = pm.Normal('log_rate_mu', mu=2, sigma=0.5, dims='segment',
+                                transform=pm.distributions.transforms.univariate_ordered,
+                                initval=np.log(np.linspace(3, 10, n_switchpoints + 1)))
+        log_rate_sigma = pm.HalfNormal('log_rate_sigma', sigma=0.5)
+        log_rates = pm.Normal('log_rate', mu=log_rate_mu, sigma=log_rate_sigma, dims=('region', 'segment'),
+                              transform=pm.distributions.transforms.univariate_ordered,
+                              initval=np.tile(np.log(np.linspace(3, 10, n_switchpoints + 1)), (n_regions, 1)))
+        rates = pm.Deterministic('rate', pt.exp(log_rates), dims=('region', 'segment'))
+
+        rate = build_switch(points, switchpoints, rates, n_switchpoints) / 100
+        sigma = pm.Uniform(name='sigma', lower=1, upper=100, dims='region')
+
+        # trainning
+        delayed = delay_regions(rate * cases, lambdas, size)
+        pm.NegativeBinomial(name=name, mu=delayed[region_index, day_index], alpha=sigma[region_index],
+                            observed=observed)
+
+    return model
@@ -0,0 +1,95 @@
+import arviz as az
+import numpy as np
+import pymc as pm
+import pytensor.tensor as pt
+
+from delays import delay_regions
+from switchpoints import build_switch
+
+
+# Admissions and deaths are the two rows of every stacked series in these models
+OUTCOMES = ('admissions', 'deaths')
+
+
+def joint_training_model(cases, observed_admissions, observed_deaths):
+    # daily_admissions_model and daily_deaths_model in one graph: both outcomes
+    # are delayed from the same cases in a single (2, N) convolution
+
+    size = len(cases)
+
+    with pm.Model() as model:
+        # data, kept in shared containers so a compiled model can be reused with pm.set_data
+        cases = pm.Data('cases', np.asarray(cases, dtype=float))
+        observed_admissions = pm.Data('observed_admissions', np.asarray(observed_admissions).astype('int64'))
+        observed_deaths = pm.Data('observed_deaths', np.asarray(observed_deaths).astype('int64'))
+
+        # priors
+        ph = pm.Uniform(name='pH', lower=0, upper=1)
+        pD = pm.Uniform(name='pD', lower=0, upper=1)
+        admissions_lambda = pm.Uniform(name='admissions_lambda', lower=0.1, upper=20)
+        deaths_lambda = pm.Uniform(name='deaths_lambda', lower=0.1, upper=20)
+        admissions_sigma = pm.Uniform(name='admissions_sigma', lower=1, upper=100)
+        deaths_sigma = pm.Uniform(name='deaths_sigma', lower=1, upper=100)
+
+        # trainning
+        new_outcomes = pt.stack([ph, pD])[:, None] * cases[None, :]
+        delayed = delay_regions(new_outcomes, pt.stack([admissions_lambda, deaths_lambda]), size,
+                                min_lambda=0.1)
+        pm.NegativeBinomial(name='admissions', mu=delayed[0], alpha=admissions_sigma,
+                            observed=observed_admissions)
+        pm.NegativeBinomial(name='deaths', mu=delayed[1], alpha=deaths_sigma,
+                            observed=observed_deaths)
+
+    return model
+
+
+def joint_switchpoints_model(cases, observed_admissions, observed_deaths, admissions_lambda,
+                             deaths_lambda, n_switchpoints):
+    # daily_switchpoints_model and deaths_switchpoints_model in one graph, each
+    # outcome with its own switchpoints, rates and dispersion
+
+    size = len(cases)
+    lambdas = np.array([admissions_lambda, deaths_lambda], dtype=float)
+
+    with pm.Model() as model:
+        # data, kept in shared containers so a compiled model can be reused with pm.set_data
+        cases = pm.Data('cases', np.asarray(cases, dtype=float))
+        observed_admissions = pm.Data('observed_admissions', np.asarray(observed_admissions).astype('int64'))
+        observed_deaths = pm.Data('observed_deaths', np.asarray(observed_deaths).astype('int64'))
+
+        points = np.arange(0, size)
+        switchpoints, rates = [], []
+        for outcome, lower in zip(OUTCOMES, (30, 0)):
+            # K = 0 is a single rate per outcome (the Ordered transform cannot
+            # take an empty vector)
+            if n_switchpoints > 0:
+                switchpoints.append(pm.Uniform(f'{outcome}_switchpoint', lower=lower, upper=size,
+                                               shape=(n_switchpoints,),
+                                               transform=pm.distributions.transforms.univariate_ordered,
+                                               initval=np.array(np.linspace(350, 550, n_switchpoints))))
+            rates.append(pm.Gamma(f'{outcome}_rate', alpha=7.5, beta=1.0, shape=(n_switchpoints+1,),
+                                  transform=pm.distributions.transforms.univariate_ordered,
+                                  initval=np.array(np.linspace(3, 10, n_switchpoints + 1))))
+
+        switchpoints = pt.stack(switchpoints) if n_switchpoints > 0 else pt.zeros((2, 0))
+        rate = build_switch(points, switchpoints, pt.stack(rates), n_switchpoints) / 100
+        admissions_sigma = pm.Uniform(name='admissions_sigma', lower=1, upper=100)
+        deaths_sigma = pm.Uniform(name='deaths_sigma', lower=1, upper=100)
+
+        # trainning
+        delayed = delay_regions(rate * cases[None, :], lambdas, size)
+        pm.NegativeBinomial(name='admissions', mu=delayed[0], alpha=admissions_sigma,
+                            observed=observed_admissions)
+        pm.NegativeBinomial(name='deaths', mu=delayed[1], alpha=deaths_sigma,
+                            observed=observed_deaths)
+
+    return model
+
+
+def outcome_view(idata, outcome):
+    # The switchpoint posterior of one outcome under the names of its
+    # single-outcome model, which is what the plots read
+    prefix = f'{outcome}_'
+    names = [name for name in idata.posterior.data_vars if name.startswith(prefix)]
+    posterior = idata.posterior[names].rename({name: name[len(prefix):] for name in names})
+    return az.InferenceData(posterior=posterior)
@@ -0,0 +1,94 @@
+import concurrent.futures
+import multiprocessing
+import time
+
+import arviz as az
+import numpy as np
+
+from result_store import load_result
+from train import estimate_daily_switchpoints
+from train_deaths import estimate_deaths_switchpoints
+from profiling import run_profile
+
+
+def posterior_medians(idata, name):
+    medians = {var: np.atleast_1d(idata.posterior[var].median(dim=('chain', 'draw')).to_numpy())
+               for var in ('switchpoint', 'rate') if var in idata.posterior}
+    medians['size'] = idata.observed_data[name].size
+    return medians
+
+
+def warm_start_initvals(medians, n_switchpoints, lower):
+    # Starts K switchpoints from a fit with fewer: its longest segment is split in
+    # two, both halves starting at that segment's rate
+    switchpoints = np.sort(medians.get('switchpoint', np.array([])))
+    rates = np.sort(medians['rate'])
+
+    while len(switchpoints) < n_switchpoints:
+        bounds = np.concatenate([[lower], switchpoints, [medians['size']]])
+        longest = int(np.argmax(np.diff(bounds)))
+        switchpoints = np.sort(np.append(switchpoints, (bounds[longest] + bounds[longest + 1]) / 2))
+        # segment j in time uses rate[K - j], so the split one is rates[-1 - longest]
+        rates = np.sort(np.append(rates, rates[-1 - longest] * 1.001))
+
+    return {'switchpoint': switchpoints, 'rate': rates}
+
+
+def fit_switchpoints(region, lam, n_switchpoints, initvals, deaths, options, profile=None):
+    # Runs in a worker process, so it is profiled on its own
+    kind = 'deaths' if deaths else 'daily'
+    with run_profile(f'{region}_{kind}_k{n_switchpoints}_{time.strftime("%Y%m%d_%H%M%S")}', profile):
+        if deaths:
+            idata = estimate_deaths_switchpoints(region=region, deaths_lambda=lam,
+                                                 n_switchpoints=n_switchpoints, initvals=initvals,
+                                                 **options)
+        else:
+            idata = estimate_daily_switchpoints(region=region, admissions_lambda=lam,
+                                                n_switchpoints=n_switchpoints, initvals=initvals,
+                                                **options)
+
+    return n_switchpoints, posterior_medians(idata, 'deaths' if deaths else 'admissions')
+
+
+def select_n_switchpoints(region, lam, max_switchpoints, deaths=False, n_workers=1, profile=None, **options):
+    # Fits K = 0..max_switchpoints on n_workers processes. Every K that is started
+    # after a smaller one finished is warm-started from the largest finished K.
+    lower = 0 if deaths else 30
+    context = multiprocessing.get_context('spawn')
+    pending = list(range(max_switchpoints + 1))
+    finished = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        running = set()
+        while pending or running:
+            while pending and len(running) < n_workers:
+                n_switchpoints = pending.pop(0)
+                previous = [k for k in finished if k < n_switchpoints]
+                initvals = (warm_start_initvals(finished[max(previous)], n_switchpoints, lower)
+                            if previous else None)
+                running.add(executor.submit(fit_switchpoints, region, lam, n_switchpoints,
+                                            initvals, deaths, options, profile))
+
+            done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                n_switchpoints, medians = future.result()
+                finished[n_switchpoints] = medians
+
+    return compare_switchpoints(region, max_switchpoints, deaths)
+
+
+def compare_switchpoints(region, max_switchpoints, deaths=False):
+    kind = 'deaths' if deaths else 'daily'
+    fits = {}
+    for n_switchpoints in range(max_switchpoints + 1):
+        name = f'switchpoints_{kind}_{n_switchpoints}_{region}'
+        # Only the pointwise log-likelihood is needed for LOO
+        fits[f'{n_switchpoints}'] = az.InferenceData(log_likelihood=load_result(name, 'log_likelihood'),
+                                                     posterior=load_result(name, 'posterior'))
+
+    comparison = az.compare(fits, ic='loo')
+    comparison.index.name = 'n_switchpoints'
+    comparison.to_csv(f'results/model_selection_{kind}_{region}.csv')
+    print(comparison)
+
+    return comparison
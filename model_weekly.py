@@ -1,27 +1,31 @@
 import numpy as np
 import pymc as pm
 
+from switchpoints import build_switch
 
-def weekly_switchpoints_model(cases, observed_admissions, n_switchpoints):
 
-    with pm.Model() as model:
+def weekly_switchpoints_model(cases, observed_admissions, n_switchpoints, name='admissions'):
+    # Weekly counts are binomial draws from the week's cases, without a delay.
+    # Admissions interpolated from weekly data (OWID) are not integers, and a
+    # lagging week can have more admissions than cases, so both are capped.
+    cases = np.rint(np.asarray(cases, dtype=float)).astype('int64')
+    observed = np.minimum(np.rint(np.asarray(observed_admissions, dtype=float)).astype('int64'), cases)
 
-        def build_switch():
-            value = rates[n_switchpoints]
-            for idx in range(0, n_switchpoints):
-                weight = pm.math.sigmoid(2 * (points - switchpoints[idx]))
-                value = weight * rates[n_switchpoints - idx - 1] + (1 - weight) * value
-            return value
+    with pm.Model() as model:
 
         points = np.arange(0, len(cases))
-        switchpoints = pm.Uniform('switchpoint', lower=0, upper=len(points), shape=(n_switchpoints,),
-                                  transform=pm.distributions.transforms.univariate_ordered,
-                                  initval=np.array([50, 100]))
+        # K = 0 is a single rate for the whole series (the Ordered transform
+        # cannot take an empty vector)
+        switchpoints = None
+        if n_switchpoints > 0:
+            switchpoints = pm.Uniform('switchpoint', lower=0, upper=len(points), shape=(n_switchpoints,),
+                                      transform=pm.distributions.transforms.univariate_ordered,
+                                      initval=np.linspace(0, len(points), n_switchpoints + 2)[1:-1])
         rates = pm.Uniform('rate', lower=0, upper=1, shape=(n_switchpoints+1,))
 
-        rate = build_switch()
+        rate = build_switch(points, switchpoints, rates, n_switchpoints)
 
         # trainning
-        pm.Binomial("admissions", p=rate, n=cases, observed=observed_admissions)
+        pm.Binomial(name, p=rate, n=cases, observed=observed)
 
     return model
@@ -1,18 +1,27 @@
 import argparse
+import os
 import sys
 
 
 def parse_args(args=sys.argv[1:]):
     parser = argparse.ArgumentParser()
 
-    parser.add_argument(
+    regions = parser.add_mutually_exclusive_group(required=True)
+
+    regions.add_argument(
         "-r",
         "--region",
         type=str,
-        required=True,
         help="A valid region abbreviation"
     )
 
+    regions.add_argument(
+        "--regions",
+        type=str,
+        nargs='+',
+        help="Several region abbreviations, run as a parallel sweep"
+    )
+
     parser.add_argument(
         "-ns",
         "--n-switchpoints",
@@ -21,12 +30,21 @@ def parse_args(args=sys.argv[1:]):
         help="Maximum number of switchpoints to test"
     )
 
+    parser.add_argument(
+        "-k",
+        "--select-k",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Fit every number of switchpoints from 0 to --n-switchpoints and rank them with LOO"
+    )
+
     parser.add_argument(
         "-w",
         "--weekly-model",
         default=False,
         action=argparse.BooleanOptionalAction,
-        help="Flag to use the weekly model or the daily model"
+        help="Fit the switchpoints on weekly totals first, then start the daily fit from them "
+             "with narrowed switchpoint priors and --warm-tune tuning draws"
     )
 
     parser.add_argument(
@@ -37,4 +55,204 @@ def parse_args(args=sys.argv[1:]):
         help="Flag to indicate if estimate deaths instead of hospitalizations"
     )
 
-    return parser.parse_args(args)
+    parser.add_argument(
+        "--delay-method",
+        type=str,
+        default='conv',
+        choices=['matrix', 'conv', 'fft'],
+        help="How the admission/death delay is applied: dense matrix, truncated convolution or FFT"
+    )
+
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default='sigmoid',
+        choices=['sigmoid', 'discrete'],
+        help="Continuous sigmoid switchpoints, or integer-day switchpoints summed out exactly"
+    )
+
+    parser.add_argument(
+        "--sampler",
+        type=str,
+        default='pymc',
+        choices=['pymc', 'nutpie', 'numpyro', 'blackjax'],
+        help="NUTS implementation used by pm.sample, falling back to pymc if it is not installed"
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Sample until the convergence targets are met instead of a fixed number of draws"
+    )
+
+    parser.add_argument(
+        "--max-draws",
+        type=int,
+        default=5000,
+        help="Maximum number of draws per chain in adaptive mode"
+    )
+
+    parser.add_argument(
+        "--target-rhat",
+        type=float,
+        default=1.01,
+        help="Largest R-hat accepted in adaptive mode"
+    )
+
+    parser.add_argument(
+        "--target-ess",
+        type=float,
+        default=400,
+        help="Smallest bulk and tail ESS accepted in adaptive mode"
+    )
+
+    parser.add_argument(
+        "--check-every",
+        type=int,
+        default=500,
+        help="Draws per chain between convergence checks in adaptive mode"
+    )
+
+    parser.add_argument(
+        "--warm-start",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Start from, and update, the stored initial values and NUTS adaptation of previous runs"
+    )
+
+    parser.add_argument(
+        "--warm-tune",
+        type=int,
+        default=500,
+        help="Tuning draws when a warm start is available"
+    )
+
+    parser.add_argument(
+        "--fast",
+        type=str,
+        nargs='?',
+        const='advi',
+        default=None,
+        choices=['advi', 'pathfinder'],
+        help="Screening mode: fit the switchpoint models by ADVI (default) or Pathfinder instead of NUTS"
+    )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        choices=['stages', 'cprofile'],
+        help="Write per-stage timings and per-chain sampler statistics to results/profiles "
+             "(cprofile: also a cProfile dump of the run)"
+    )
+
+    parser.add_argument(
+        "--resume",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Skip train/estimate stages whose settings, code and input data match a finished run "
+             "recorded in results/manifest"
+    )
+
+    parser.add_argument(
+        "--both",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Fit admissions and deaths together, in one model sharing the case series (Spanish regions)"
+    )
+
+    parser.add_argument(
+        "--joint",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Estimate the switchpoints of all --regions in one hierarchical model"
+    )
+
+    parser.add_argument(
+        "--predictive",
+        type=str,
+        default='full',
+        choices=['full', 'streaming'],
+        help="Keep all posterior predictive draws, or only their quantile bands, computed in batches"
+    )
+
+    parser.add_argument(
+        "--predictive-thin",
+        type=int,
+        default=1,
+        help="Use every n-th posterior draw for the posterior predictive in streaming mode"
+    )
+
+    parser.add_argument(
+        "--downcast",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+        help="Store posterior predictive draws in single precision"
+    )
+
+    parser.add_argument(
+        "--incremental",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Re-estimate with newly arrived data: keep the training fit, warm start from the "
+             "previous run and sample adaptively until the convergence targets are met"
+    )
+
+    parser.add_argument(
+        "--end-date",
+        type=str,
+        default=None,
+        help="Last day of the switchpoint window (with --incremental, defaults to the last day with data)"
+    )
+
+    parser.add_argument(
+        "--window-starts",
+        type=str,
+        nargs='+',
+        default=None,
+        help="Sensitivity mode: fit the switchpoints on every window from these start dates to "
+             "each of --window-ends, and tabulate them in results/sensitivity_*.csv"
+    )
+
+    parser.add_argument(
+        "--window-ends",
+        type=str,
+        nargs='+',
+        default=None,
+        help="End dates of the sensitivity windows (default: --end-date or the usual end)"
+    )
+
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=os.cpu_count(),
+        help="Total number of cores a sweep may use, shared between the chains of all regions"
+    )
+
+    parser.add_argument(
+        "--chains",
+        type=int,
+        default=4,
+        help="Number of chains per sampling run"
+    )
+
+    parsed = parser.parse_args(args)
+    # The hierarchical model has a single delay (truncated convolution over all
+    # regions) and continuous switchpoints
+    if parsed.joint and (parsed.delay_method != 'conv' or parsed.engine != 'sigmoid'):
+        parser.error('--joint supports only --delay-method conv and --engine sigmoid')
+
+    return parsed
+
+
+def adaptive_settings(args):
+    if not args.adaptive and not args.incremental:
+        return None
+
+    return {
+        'max_draws': args.max_draws,
+        'rhat': args.target_rhat,
+        'ess': args.target_ess,
+        'check_every': args.check_every
+    }
@@ -2,48 +2,34 @@ import numpy as np
 import pandas as pd
 from matplotlib import pyplot as plt
 
+from predictive import QUANTILES
+from utils import week_labels
 
-def plot_daily_pH_training(data, start_date, end_date,region = None):
-    posterior_quantile = np.percentile(data['admissions'], [2.5, 25, 50, 75, 97.5], axis=1)
-    dates = pd.date_range(start_date, end_date).strftime('%m-%d')
-    plot_dates = [dates[i] for i in range(0, len(posterior_quantile[2, :]), 21)]
 
-    plt.figure()
-    plt.plot(
-        dates, posterior_quantile[2, :],
-        color='b', label='posterior median', lw=2
-    )
+def band_quantiles(data, key):
+    # Bands summarised while sampling the predictive, or computed here from all draws
+    if f'{key}_quantiles' in data:
+        return data[f'{key}_quantiles']
+    return np.percentile(data[key], QUANTILES, axis=1)
 
-    plt.fill_between(
-        dates, posterior_quantile[0, :], posterior_quantile[4, :],
-        color='b', label='95% quantile', alpha=.2
-    )
 
-    plt.plot(
-        dates, data['hospitalized'],
-        '--o', color='k', markersize=3,
-        label='Observed admissions', alpha=.8
-    )
+def switchpoint_quantiles(trace, n_switchpoints):
+    # (K, 3) lower, median and upper 95% values of each switchpoint
+    if n_switchpoints == 0:
+        return np.zeros((0, 3))
+    values = trace.posterior['switchpoint'].quantile((.025, .5, .975), dim=('chain', 'draw'))
+    return values.to_numpy().T.reshape(n_switchpoints, 3)
 
-    plt.xticks(plot_dates)
-    plt.ylabel('Daily number of admissions', fontsize='large')
-    plt.xlabel('Day', fontsize='large')
 
-    fontsize = 'medium'
-    plt.legend(loc='upper left', fontsize=fontsize)
-
-    plt.savefig(f'plots/fit_{region}.png')
-
-
-def plot_daily_switchpoints(data, start_date, end_date, trace, n_switchpoints,region = None):
-    print('\n Im plotting switchpoints')
-    posterior_quantile = np.percentile(data['admissions'], [2.5, 25, 50, 75, 97.5], axis=1)
+def plot_fit(dates, posterior_quantile, observed, ylabel, xlabel, tick_step, training=False,
+             switchpoints=None, label='Observed admissions', path=None):
+    # Median and 95% band of the posterior predictive against the observations,
+    # with each switchpoint's median and 95% interval. Once saved, the figure is
+    # closed together with the trace plots drawn before it, so sweeps do not
+    # accumulate open figures.
+    plot_dates = [dates[i] for i in range(0, len(posterior_quantile[2, :]), tick_step)]
 
-    dates = pd.date_range(start_date, end_date).strftime('%y-%m-%d')
-    plot_dates = [dates[i] for i in range(0, len(posterior_quantile[2, :]), 21)]
-
-    plt.figure()
-    # Data
+    figure = plt.figure()
     plt.plot(
         dates, posterior_quantile[2, :],
         color='b', label='posterior median', lw=2
@@ -54,66 +40,24 @@ def plot_daily_switchpoints(data, start_date, end_date, trace, n_switchpoints,re
         color='b', label='95% quantile', alpha=.2
     )
 
-    plt.plot(
-        dates, data['hospitalized'], '.',
-        alpha=0.6, markersize=3, label='Observed admissions')
-
-    # Switchpoints with CI
-    for idx in range(n_switchpoints):
-        values = trace.posterior.quantile((.025, .5, .975), dim=('chain', 'draw'))
-        point = values['switchpoint'].values[:, idx]
-        plt.vlines(dates[int(point[1])],
-                   data['hospitalized'].min(), data['hospitalized'].max(), color='C1')
-
-        plt.fill_betweenx(
-            y=[data['hospitalized'].min(), data['hospitalized'].max()],
-            x1=dates[int(point[0])],
-            x2=dates[int(point[2])],
-            alpha=0.5,
-            color="C1",
+    if training:
+        plt.plot(
+            dates, observed,
+            '--o', color='k', markersize=3,
+            label=label, alpha=.8
         )
-
-    plt.xticks(plot_dates)
-    plt.ylabel('Daily number of admissions', fontsize='large')
-    plt.xlabel('Day', fontsize='large')
-
-    fontsize = 'medium'
-    plt.legend(loc='upper left', fontsize=fontsize)
-    plt.savefig(f'plots/fit_{region}_switchpoints_new.png')
-
-
-
-def plot_weekly_switchpoints(data, start_date, end_date, trace, n_switchpoints):
-    posterior_quantile = np.percentile(data['admissions'], [2.5, 25, 50, 75, 97.5], axis=1)
-
-    dates = pd.date_range(start_date, end_date, freq='W').strftime('%y-%m-%d')
-    plot_dates = [dates[i] for i in range(0, len(posterior_quantile[2, :]), 6)]
-
-    plt.figure()
-    # Data
-    plt.plot(
-        dates, posterior_quantile[2, :],
-        color='b', label='posterior median', lw=2
-    )
-
-    plt.fill_between(
-        dates, posterior_quantile[0, :], posterior_quantile[4, :],
-        color='b', label='95% quantile', alpha=.2
-    )
-
-    plt.plot(
-        dates, data['hospitalized'], '.',
-        alpha=0.6, markersize=3, label='Observed admissions')
+    else:
+        plt.plot(
+            dates, observed, '.',
+            alpha=0.6, markersize=3, label=label)
 
     # Switchpoints with CI
-    for idx in range(n_switchpoints):
-        values = trace.posterior.quantile((.025, .5, .975), dim=('chain', 'draw'))
-        point = values['switchpoint'].values[:, idx]
+    for point in (switchpoints if switchpoints is not None else []):
         plt.vlines(dates[int(point[1])],
-                   data['hospitalized'].min(), data['hospitalized'].max(), color='C1')
+                   observed.min(), observed.max(), color='C1')
 
         plt.fill_betweenx(
-            y=[data['hospitalized'].min(), data['hospitalized'].max()],
+            y=[observed.min(), observed.max()],
             x1=dates[int(point[0])],
             x2=dates[int(point[2])],
             alpha=0.5,
@@ -121,83 +65,51 @@ def plot_weekly_switchpoints(data, start_date, end_date, trace, n_switchpoints):
         )
 
     plt.xticks(plot_dates)
-    plt.ylabel('Weekly number of admissions', fontsize='large')
-    plt.xlabel('Week', fontsize='large')
+    plt.ylabel(ylabel, fontsize='large')
+    plt.xlabel(xlabel, fontsize='large')
 
     fontsize = 'medium'
     plt.legend(loc='upper left', fontsize=fontsize)
 
-def plot_daily_pD_training(data, start_date, end_date):
-    posterior_quantile = np.percentile(data['deaths_estimated'], [2.5, 25, 50, 75, 97.5], axis=1)
-
-    dates = pd.date_range(start_date, end_date).strftime('%m-%d')
-    plot_dates = [dates[i] for i in range(0, len(posterior_quantile[2, :]), 21)]
-
-    plt.figure()
-    plt.plot(
-        dates, posterior_quantile[2, :],
-        color='b', label='posterior median', lw=2
-    )
-
-    plt.fill_between(
-        dates, posterior_quantile[0, :], posterior_quantile[4, :],
-        color='b', label='95% quantile', alpha=.2
-    )
-
-    plt.plot(
-        dates, data['deaths_observed'],
-        '--o', color='k', markersize=3,
-        label='Observed admissions', alpha=.8
-    )
-
-    plt.xticks(plot_dates)
-    plt.ylabel('Daily number of deaths', fontsize='large')
-    plt.xlabel('Day', fontsize='large')
+    if path is not None:
+        plt.savefig(path)
+        plt.close('all')
+    return figure
 
-    fontsize = 'medium'
-    plt.legend(loc='upper left', fontsize=fontsize)
 
+def plot_daily_pH_training(data, start_date, end_date,region = None):
+    dates = pd.date_range(start_date, end_date).strftime('%m-%d')
+    plot_fit(dates, band_quantiles(data, 'admissions'), data['hospitalized'],
+             'Daily number of admissions', 'Day', 21, training=True,
+             path=f'plots/fit_{region}.png')
 
-def plot_deaths_switchpoints(data, start_date, end_date, trace, n_switchpoints):
-    posterior_quantile = np.percentile(data['deaths_estimated'], [2.5, 25, 50, 75, 97.5], axis=1)
 
+def plot_daily_switchpoints(data, start_date, end_date, trace, n_switchpoints,region = None):
     dates = pd.date_range(start_date, end_date).strftime('%y-%m-%d')
-    plot_dates = [dates[i] for i in range(0, len(posterior_quantile[2, :]), 21)]
-
-    plt.figure()
-    # Data
-    plt.plot(
-        dates, posterior_quantile[2, :],
-        color='b', label='posterior median', lw=2
-    )
+    plot_fit(dates, band_quantiles(data, 'admissions'), data['hospitalized'],
+             'Daily number of admissions', 'Day', 21,
+             switchpoints=switchpoint_quantiles(trace, n_switchpoints),
+             path=f'plots/fit_{region}_switchpoints_new.png')
 
-    plt.fill_between(
-        dates, posterior_quantile[0, :], posterior_quantile[4, :],
-        color='b', label='95% quantile', alpha=.2
-    )
 
-    plt.plot(
-        dates, data['deaths_observed'], '.',
-        alpha=0.6, markersize=3, label='Observed admissions')
+def plot_weekly_switchpoints(data, start_date, end_date, trace, n_switchpoints, region=None):
+    dates = week_labels(start_date, end_date).strftime('%y-%m-%d')
+    plot_fit(dates, band_quantiles(data, 'admissions'), data['hospitalized'],
+             'Weekly number of admissions', 'Week', 6,
+             switchpoints=switchpoint_quantiles(trace, n_switchpoints),
+             path=f'plots/fit_weekly_{region}_switchpoints_{n_switchpoints}.png')
 
-    # Switchpoints with CI
-    for idx in range(n_switchpoints):
-        values = trace.posterior.quantile((.025, .5, .975), dim=('chain', 'draw'))
-        point = values['switchpoint'].values[:, idx]
-        plt.vlines(dates[int(point[1])],
-                   data['deaths_observed'].min(), data['deaths_observed'].max(), color='C1')
 
-        plt.fill_betweenx(
-            y=[data['deaths_observed'].min(), data['deaths_observed'].max()],
-            x1=dates[int(point[0])],
-            x2=dates[int(point[2])],
-            alpha=0.5,
-            color="C1",
-        )
+def plot_daily_pD_training(data, start_date, end_date, region=None):
+    dates = pd.date_range(start_date, end_date).strftime('%m-%d')
+    plot_fit(dates, band_quantiles(data, 'deaths_estimated'), data['deaths_observed'],
+             'Daily number of deaths', 'Day', 21, training=True,
+             path=f'plots/fit_deaths_{region}.png')
 
-    plt.xticks(plot_dates)
-    plt.ylabel('Daily number of deaths', fontsize='large')
-    plt.xlabel('Day', fontsize='large')
 
-    fontsize = 'medium'
-    plt.legend(loc='upper left', fontsize=fontsize)
+def plot_deaths_switchpoints(data, start_date, end_date, trace, n_switchpoints, region=None):
+    dates = pd.date_range(start_date, end_date).strftime('%y-%m-%d')
+    plot_fit(dates, band_quantiles(data, 'deaths_estimated'), data['deaths_observed'],
+             'Daily number of deaths', 'Day', 21,
+             switchpoints=switchpoint_quantiles(trace, n_switchpoints),
+             path=f'plots/fit_deaths_{region}_switchpoints_{n_switchpoints}.png')
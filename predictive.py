@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+QUANTILES = (2.5, 25, 50, 75, 97.5)
+
+# Posterior draws per chain sent to sample_posterior_predictive at a time
+PREDICTIVE_BATCH = 250
+
+
+class CountQuantiles:
+    # Per-day histograms of integer predictive draws. Memory depends on the
+    # number of days and the largest count seen, not on the number of draws, and
+    # the quantiles are exactly those of np.percentile on all the draws.
+
+    def __init__(self, size):
+        self.counts = np.zeros((size, 1), dtype=np.int64)
+
+    def update(self, draws):
+        size = self.counts.shape[0]
+        draws = np.asarray(draws, dtype=np.int64).reshape(-1, size)
+        width = max(self.counts.shape[1], int(draws.max()) + 1)
+        if width > self.counts.shape[1]:
+            self.counts = np.pad(self.counts, ((0, 0), (0, width - self.counts.shape[1])))
+
+        index = np.arange(size) * width + draws
+        self.counts += np.bincount(index.ravel(), minlength=size * width).reshape(size, width)
+
+    def quantiles(self, q=QUANTILES):
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        bands = np.zeros((len(q), len(total)))
+        for i, percent in enumerate(q):
+            # Linear interpolation between the order statistics, as np.percentile
+            position = (total - 1) * percent / 100
+            lower = np.floor(position)
+            below = (cumulative <= lower[:, None]).sum(axis=1)
+            above = (cumulative <= np.minimum(lower + 1, total - 1)[:, None]).sum(axis=1)
+            bands[i] = below + (position - lower) * (above - below)
+        return bands
+
+
+def predictive_quantiles(idata, name, model=None, thin=1, batch_size=PREDICTIVE_BATCH, q=QUANTILES):
+    # Quantile bands (len(q), days) of the posterior predictive of name, drawn in
+    # batches of batch_size draws per chain from every thin-th posterior draw.
+    # Without a model, the draws already in idata are summarised the same way.
+    if model is None:
+        draws = idata.posterior_predictive[name].isel(draw=slice(None, None, thin))
+        batches = (draws.isel(draw=slice(start, start + batch_size)).to_numpy()
+                   for start in range(0, draws.sizes['draw'], batch_size))
+    else:
+        import pymc as pm  # plots only need QUANTILES, so pymc is imported on first use
+
+        posterior = idata.posterior.isel(draw=slice(None, None, thin))
+        batches = (pm.sample_posterior_predictive(posterior.isel(draw=slice(start, start + batch_size)),
+                                                  model=model, var_names=[name], progressbar=False)
+                   .posterior_predictive[name].to_numpy()
+                   for start in range(0, posterior.sizes['draw'], batch_size))
+
+    sketch = CountQuantiles(idata.observed_data[name].size)
+    for batch in batches:
+        sketch.update(batch)
+
+    return sketch.quantiles(q)
+
+
+def add_predictive_quantiles(idata, name, bands, q=QUANTILES):
+    dataset = xr.Dataset({name: (('quantile', f'{name}_dim_0'), bands)}, coords={'quantile': list(q)})
+    if 'predictive_quantiles' in idata.groups():
+        idata.predictive_quantiles[name] = dataset[name]
+    else:
+        idata.add_groups(predictive_quantiles=dataset)
+
+
+def stream_predictive(idata, name, model=None, thin=1):
+    # Streaming mode: only the quantile bands are kept in idata. The discrete
+    # engine draws its predictive while sampling, so those draws are summarised
+    # and then dropped.
+    add_predictive_quantiles(idata, name, predictive_quantiles(idata, name, model, thin))
+    if model is None and 'posterior_predictive' in idata.groups():
+        del idata.posterior_predictive
+
+
+def plot_predictive(idata, name, key, predictive):
+    # Entry of the data dict the plots take: the bands, or all draws as (days, samples)
+    if predictive == 'streaming':
+        return {f'{key}_quantiles': idata.predictive_quantiles[name].to_numpy()}
+    return {key: idata.posterior_predictive[name].stack(sample=('chain', 'draw')).to_numpy()}
+
+
+def summarize(idata, kind, region, start_date, end_date, n_switchpoints=0, freq='D', switchpoints=None):
+    # Summary of a fit for the plots (see result_store.save_summary). The
+    # switchpoint posterior is read from switchpoints, idata by default (the
+    # joint fits pass model_joint.outcome_view).
+    name = 'deaths' if 'deaths' in kind else 'admissions'
+    posterior = (idata if switchpoints is None else switchpoints).posterior
+    if 'predictive_quantiles' in idata.groups():
+        bands = idata.predictive_quantiles[name].to_numpy()
+    else:
+        bands = predictive_quantiles(idata, name)
+
+    switchpoints = np.zeros((0, 3))
+    if n_switchpoints > 0:
+        values = posterior['switchpoint'].quantile((.025, .5, .975), dim=('chain', 'draw'))
+        switchpoints = values.to_numpy().T.reshape(n_switchpoints, 3)
+
+    return {
+        'kind': kind,
+        'region': region,
+        'n_switchpoints': n_switchpoints,
+        'dates': pd.date_range(start_date, end_date, freq=freq).strftime('%Y-%m-%d').tolist(),
+        'observed': idata.observed_data[name].to_numpy(),
+        'quantiles': list(QUANTILES),
+        'bands': bands,
+        'switchpoints': switchpoints,
+    }
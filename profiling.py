@@ -0,0 +1,151 @@
+import cProfile
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+
+PROFILE_DIR = 'results/profiles'
+
+# Profiles of the runs in progress in this process, innermost last. Stage marks
+# are no-ops when it is empty, so the entry points can always call them.
+ACTIVE = []
+
+
+class RunProfile:
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.sampling = []
+        self.current = None
+        self.clock = None
+
+    def mark(self, stage, label, now=None):
+        # Ends the stage in progress and, unless stage is None, starts a new one,
+        # now or at an earlier perf_counter time
+        now = time.perf_counter() if now is None else now
+        if self.current is not None:
+            name, run, start = self.current
+            self.stages.append({'run': run, 'stage': name, 'wall_time': now - start,
+                                'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+            print(f'[{self.name}] {run} {name}: {now - start:.1f}s')
+        self.current = None if stage is None else (stage, label, now)
+
+    def report(self):
+        return {'name': self.name, 'pid': os.getpid(), 'stages': self.stages, 'sampling': self.sampling}
+
+
+class SamplingClock:
+    # pm.sample callback noting, per chain, the first draw, the first draw after
+    # tuning and the last draw, wrapping the callback already in use (if any)
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.first = {}
+        self.tuned = {}
+        self.last = {}
+
+    def __call__(self, trace, draw):
+        now = time.perf_counter()
+        self.first.setdefault(draw.chain, now)
+        if not draw.tuning:
+            self.tuned.setdefault(draw.chain, now)
+        self.last[draw.chain] = now
+        if self.callback is not None:
+            self.callback(trace, draw)
+
+    def times(self, chain):
+        first, last = self.first.get(chain), self.last.get(chain)
+        if first is None:
+            return {}
+        tuned = self.tuned.get(chain, last)
+        return {'tuning_time': tuned - first, 'draw_time': last - tuned}
+
+
+@contextmanager
+def run_profile(name, mode=None):
+    # Profiles everything run inside it: stage timings and sampler statistics to
+    # results/profiles/{name}.json, and with mode 'cprofile' a {name}.prof that
+    # snakeviz or pstats can read. For py-spy, attach to the pid in the report.
+    if mode is None:
+        yield None
+        return
+
+    profile = RunProfile(name)
+    profiler = cProfile.Profile() if mode == 'cprofile' else None
+    ACTIVE.append(profile)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield profile
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        profile.mark(None, None)
+        ACTIVE.remove(profile)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f'{name}.json'), 'w') as file:
+            json.dump(profile.report(), file, indent=1, default=float)
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f'{name}.prof'))
+
+
+def profile_stage(stage, label=''):
+    if ACTIVE:
+        ACTIVE[-1].mark(stage, label)
+
+
+def profiled_sample_kwargs(kwargs):
+    # Times tuning and drawing separately through a pm.sample callback; external
+    # NUTS samplers take no callback and are only timed as a whole
+    if not ACTIVE or 'nuts_sampler' in kwargs:
+        return kwargs
+    clock = SamplingClock(kwargs.get('callback'))
+    ACTIVE[-1].clock = clock
+    return dict(kwargs, callback=clock)
+
+
+def split_compile(profile):
+    # Everything in the sampling stage before the first draw (compiling logp and
+    # its gradient, NUTS initialisation, starting the chain processes) is
+    # recorded as a 'compile' stage of its own
+    if profile.clock is None or not profile.clock.first or profile.current is None:
+        return
+    stage, label, start = profile.current
+    profile.current = ('compile', label, start)
+    profile.mark(stage, label, min(profile.clock.first.values()))
+
+
+def profile_sampler_stats(idata, label=''):
+    # Per-chain tree depth, gradient evaluations, divergences and ESS per second
+    if not ACTIVE or 'sample_stats' not in idata.groups():
+        return
+    import arviz as az
+
+    profile = ACTIVE[-1]
+    split_compile(profile)
+    stats = idata.sample_stats
+    posterior = idata.posterior[[name for name in idata.posterior.data_vars if not name.endswith('__')]]
+
+    for chain in stats.chain.values:
+        chain_stats = stats.sel(chain=chain)
+        row = {'run': label, 'chain': int(chain), 'draws': int(chain_stats.sizes['draw'])}
+        if 'tree_depth' in chain_stats:
+            row['mean_tree_depth'] = float(chain_stats['tree_depth'].mean())
+        if 'n_steps' in chain_stats:
+            row['gradient_evaluations'] = int(chain_stats['n_steps'].sum())
+        if 'diverging' in chain_stats:
+            row['divergences'] = int(chain_stats['diverging'].sum())
+        if 'step_size' in chain_stats:
+            row['step_size'] = float(chain_stats['step_size'].mean())
+        ess = az.ess(posterior.sel(chain=[chain]), method='bulk')
+        row['min_ess_bulk'] = min(float(ess[name].min()) for name in ess.data_vars)
+        if profile.clock is not None:
+            row.update(profile.clock.times(int(chain)))
+            if row.get('draw_time'):
+                row['ess_bulk_per_second'] = row['min_ess_bulk'] / row['draw_time']
+        profile.sampling.append(row)
+    profile.clock = None
@@ -0,0 +1,60 @@
+import argparse
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+
+import matplotlib
+matplotlib.use('Agg')  # headless, and before pyplot is first imported
+
+import pandas as pd
+
+from plots import plot_fit
+from result_store import SUMMARY_DIR, load_summary
+
+
+# Axis labels, tick spacing and date format of each kind of fit. Each figure is
+# named after its summary (plots/{summary}.png), which carries the K and the
+# window of the fit, so selection and window sweeps never share an output file.
+RENDER_SETTINGS = {
+    'train_daily': ('Daily number of admissions', 'Day', 21, '%m-%d'),
+    'train_deaths': ('Daily number of deaths', 'Day', 21, '%m-%d'),
+    'daily': ('Daily number of admissions', 'Day', 21, '%y-%m-%d'),
+    'deaths': ('Daily number of deaths', 'Day', 21, '%y-%m-%d'),
+    # The --both fits, one summary per outcome, drawn as the single-outcome fits
+    'train_both_admissions': ('Daily number of admissions', 'Day', 21, '%m-%d'),
+    'train_both_deaths': ('Daily number of deaths', 'Day', 21, '%m-%d'),
+    'both_admissions': ('Daily number of admissions', 'Day', 21, '%y-%m-%d'),
+    'both_deaths': ('Daily number of deaths', 'Day', 21, '%y-%m-%d'),
+    'weekly': ('Weekly number of admissions', 'Week', 6, '%y-%m-%d'),
+}
+
+
+def render_summary(path):
+    summary = load_summary(path)
+    ylabel, xlabel, tick_step, date_format = RENDER_SETTINGS[summary['kind']]
+    output = os.path.join('plots', os.path.splitext(os.path.basename(path))[0] + '.png')
+
+    dates = pd.to_datetime(summary['dates']).strftime(date_format)
+    plot_fit(dates, summary['bands'], summary['observed'], ylabel, xlabel, tick_step,
+             training=summary['kind'].startswith('train'), switchpoints=summary['switchpoints'],
+             path=output)
+    return output
+
+
+def render_all(paths, n_workers):
+    os.makedirs('plots', exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        for output in executor.map(render_summary, paths):
+            print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pattern", type=str, default='*',
+                        help="Summaries to render, e.g. 'switchpoints_daily_2_*'")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    render_all(sorted(glob.glob(os.path.join(SUMMARY_DIR, f'{args.pattern}.json'))), args.workers)
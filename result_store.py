@@ -0,0 +1,99 @@
+import json
+import os
+
+import h5netcdf
+import numpy as np
+import xarray as xr
+
+
+RESULTS_DIR = 'results'
+
+# Draws per chunk; the other dimensions (days, switchpoints) are kept whole so
+# a variable can be read back one block of draws at a time
+DRAW_CHUNK = 500
+COMPRESSION = {'zlib': True, 'complevel': 4, 'shuffle': True}
+
+# Groups whose draws are stored in single precision when downcasting
+DOWNCAST_GROUPS = ('posterior_predictive', 'prior_predictive')
+
+
+def result_path(name):
+    return os.path.join(RESULTS_DIR, f'{name}.nc')
+
+
+def downcast_dataset(dataset):
+    # float64 -> float32 and int64 -> int32; predictive counts fit easily in either
+    return dataset.map(lambda array: array.astype(np.float32) if array.dtype == np.float64
+                       else array.astype(np.int32) if array.dtype == np.int64 else array)
+
+
+def encoding(dataset):
+    encodings = {}
+    for name, array in dataset.data_vars.items():
+        # HDF5 rejects chunks of size 0, so empty arrays are stored unchunked
+        if array.ndim == 0 or array.size == 0 or array.dtype.kind not in 'biuf':
+            continue
+        chunks = tuple(min(DRAW_CHUNK, size) if dim == 'draw' else size
+                       for dim, size in zip(array.dims, array.shape))
+        encodings[name] = dict(COMPRESSION, chunksizes=chunks)
+    return encodings
+
+
+def save_result(idata, name, downcast=True):
+    # One NetCDF4 file per fit, each InferenceData group stored as its own
+    # compressed and chunked netCDF group
+    path = result_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = 'w'
+    for group in idata.groups():
+        dataset = idata[group]
+        if downcast and group in DOWNCAST_GROUPS:
+            dataset = downcast_dataset(dataset)
+        dataset.to_netcdf(path, mode=mode, group=group, engine='h5netcdf',
+                          encoding=encoding(dataset))
+        mode = 'a'
+    return path
+
+
+def load_result(name, group='posterior', var_names=None):
+    # Lazy: values are only read from disk when used, and only for var_names
+    dataset = xr.open_dataset(result_path(name), group=group, engine='h5netcdf')
+    if var_names is not None:
+        dataset = dataset[var_names]
+    return dataset
+
+
+def load_idata(name, groups=('posterior',)):
+    import arviz as az  # not needed by the light readers (plots, summaries)
+
+    return az.InferenceData(**{group: load_result(name, group) for group in groups})
+
+
+def result_groups(name):
+    with h5netcdf.File(result_path(name), 'r') as file:
+        return list(file.groups)
+
+
+SUMMARY_DIR = os.path.join(RESULTS_DIR, 'summaries')
+
+
+def summary_path(name):
+    return os.path.join(SUMMARY_DIR, f'{name}.json')
+
+
+def save_summary(name, summary):
+    # The few numbers a figure needs (dates, observations, predictive bands and
+    # switchpoint intervals), so plots never have to open the full results
+    os.makedirs(SUMMARY_DIR, exist_ok=True)
+    summary = {key: np.asarray(value).tolist() if isinstance(value, np.ndarray) else value
+               for key, value in summary.items()}
+    with open(summary_path(name), 'w') as file:
+        json.dump(summary, file)
+
+
+def load_summary(path):
+    with open(path) as file:
+        summary = json.load(file)
+    for key in ('observed', 'bands', 'switchpoints'):
+        summary[key] = np.asarray(summary[key])
+    return summary
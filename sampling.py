@@ -0,0 +1,171 @@
+import importlib.util
+import os
+
+import arviz as az
+import numpy as np
+import pymc as pm
+from pymc.initial_point import make_initial_point_fn
+
+
+# Python modules each NUTS backend of pm.sample needs
+SAMPLER_MODULES = {
+    'pymc': [],
+    'nutpie': ['nutpie'],
+    'numpyro': ['jax', 'numpyro'],
+    'blackjax': ['jax', 'blackjax'],
+}
+
+# Approximate inference methods for --fast and the modules each needs
+APPROXIMATION_MODULES = {
+    'advi': [],
+    'pathfinder': ['pymc_experimental', 'blackjax'],
+}
+ADVI_ITERATIONS = 30000
+
+# Attempts per chain at a jittered starting point with a finite log-probability,
+# as pm.sample's jitter_max_retries
+JITTER_RETRIES = 10
+
+
+class ConvergenceMonitor:
+    # pm.sample callback that stops sampling (by raising KeyboardInterrupt, which
+    # pm.sample turns into an early return) once every chain has passed the tuning
+    # phase and R-hat and bulk/tail ESS meet their targets. Checked every
+    # check_every draws per chain.
+
+    def __init__(self, chains, target_rhat=1.01, target_ess=400, check_every=500):
+        self.chains = chains
+        self.target_rhat = target_rhat
+        self.target_ess = target_ess
+        self.check_every = check_every
+        self.draws = [[] for _ in range(chains)]
+        self.next_check = check_every
+
+    def __call__(self, trace, draw):
+        if draw.tuning:
+            return
+
+        self.draws[draw.chain].append(draw.point)
+        n_draws = min(len(chain) for chain in self.draws)
+        if n_draws < self.next_check:
+            return
+
+        self.next_check += self.check_every
+        if self.converged(n_draws):
+            raise KeyboardInterrupt
+
+    def converged(self, n_draws):
+        names = self.draws[0][0].keys()
+        dataset = az.convert_to_dataset({
+            name: np.array([[np.asarray(point[name]) for point in chain[:n_draws]]
+                            for chain in self.draws])
+            for name in names
+        })
+
+        ess_bulk = az.ess(dataset, method='bulk')
+        ess_tail = az.ess(dataset, method='tail')
+        worst_ess = min(float(ess[name].min()) for ess in (ess_bulk, ess_tail) for name in names)
+        if worst_ess < self.target_ess:
+            return False
+
+        if self.chains > 1:
+            rhat = az.rhat(dataset)
+            return max(float(rhat[name].max()) for name in names) <= self.target_rhat
+
+        return True
+
+
+def available_sampler(sampler, chains):
+    missing = [module for module in SAMPLER_MODULES[sampler] if importlib.util.find_spec(module) is None]
+    if missing:
+        print(f'Sampler {sampler} is not available ({", ".join(missing)} not installed), using pymc')
+        return 'pymc'
+
+    if 'jax' in SAMPLER_MODULES[sampler]:
+        # Only takes effect before jax is first imported
+        os.environ.setdefault('JAX_PLATFORMS', 'cpu')
+        os.environ.setdefault('XLA_FLAGS', f'--xla_force_host_platform_device_count={chains}')
+
+    return sampler
+
+
+def sample_kwargs(draws, chains, adaptive=None, sampler='pymc', step=None, target_accept=None):
+    # Keyword arguments for pm.sample: a fixed number of draws, or, in adaptive
+    # mode, up to max_draws with a convergence check every few draws. A step
+    # (cached or warm-started) already carries its target_accept, and pm.sample
+    # rejects one given alongside it.
+    sampler = available_sampler(sampler, chains)
+    accept = {} if target_accept is None or (step is not None and sampler == 'pymc') \
+        else {'target_accept': target_accept}
+    if sampler != 'pymc':
+        # External samplers compile their own logp and take neither steps nor callbacks
+        if adaptive:
+            print(f'Adaptive sampling is not supported by {sampler}, drawing {draws} samples')
+        return {'draws': draws, 'nuts_sampler': sampler, **accept}
+
+    if not adaptive:
+        return {'draws': draws, 'step': step, **accept}
+
+    monitor = ConvergenceMonitor(chains, adaptive['rhat'], adaptive['ess'], adaptive['check_every'])
+    return {'draws': adaptive['max_draws'], 'step': step, 'callback': monitor, **accept}
+
+
+def chain_initvals(model, initvals, chains, step, seed=None):
+    # pm.sample skips init_nuts when given a NUTS step (cached or warm-started),
+    # and with it the jitter of the starting points: every chain would start from
+    # the same values, and R-hat, which --adaptive stops on, would miss modes the
+    # chains never left. The same jitter as init_nuts instead, uniform(-1, 1) on
+    # the transformed values, as one dict of initial values per chain.
+    if step is None:
+        return initvals
+
+    overrides = {name: value for name, value in (initvals or {}).items() if value is not None}
+    logp = model.compile_logp()
+    untransform = model.compile_fn(model.replace_rvs_by_values(model.free_RVs), inputs=model.value_vars,
+                                   on_unused_input='ignore')
+    jittered = make_initial_point_fn(model=model, overrides=overrides, jitter_rvs=set(model.free_RVs))
+    rng = np.random.default_rng(seed)
+
+    points = []
+    for _ in range(chains):
+        point = None
+        for _ in range(JITTER_RETRIES):
+            candidate = jittered(rng.integers(2 ** 30))
+            if np.isfinite(logp(candidate)):
+                point = candidate
+                break
+        if point is None:
+            # No jitter for this chain rather than a failed start
+            points.append(overrides)
+            continue
+        points.append({rv.name: value for rv, value in zip(model.free_RVs, untransform(point))})
+    return points
+
+
+def approximate_posterior(model, draws, method='advi', initvals=None, seed=None):
+    # Screening fits: draws from a mean-field ADVI or Pathfinder approximation,
+    # as a one-chain InferenceData with the pointwise log-likelihood added
+    missing = [module for module in APPROXIMATION_MODULES[method] if importlib.util.find_spec(module) is None]
+    if missing:
+        print(f'Approximation {method} is not available ({", ".join(missing)} not installed), using advi')
+        method = 'advi'
+
+    start = {name: value for name, value in (initvals or {}).items() if value is not None}
+    with model:
+        if method == 'pathfinder':
+            import pymc_experimental as pmx
+            # fit_pathfinder takes the number of draws as samples (other keywords
+            # go to blackjax's L-BFGS) and starts from the model's initial point,
+            # with no initvals argument
+            for rv in model.free_RVs:
+                if rv.name in start:
+                    model.set_initval(rv, start[rv.name])
+            idata = pmx.fit(method='pathfinder', samples=draws, random_seed=seed)
+        else:
+            approximation = pm.fit(n=ADVI_ITERATIONS, method='advi', start=start, random_seed=seed,
+                                   progressbar=False,
+                                   callbacks=[pm.callbacks.CheckParametersConvergence(diff='absolute')])
+            idata = approximation.sample(draws, random_seed=seed)
+        pm.compute_log_likelihood(idata, progressbar=False)
+
+    return idata
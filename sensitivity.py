@@ -0,0 +1,130 @@
+import concurrent.futures
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from train import estimate_daily_switchpoints
+from train_deaths import estimate_deaths_switchpoints
+from utils import load_data
+
+
+# Columns of the consolidated table, one row per window and switchpoint
+# (a window whose fit failed has a single row with the error)
+TABLE_COLUMNS = ['region', 'start_date', 'end_date', 'switchpoint', 'lower', 'lower_date',
+                 'median', 'median_date', 'upper', 'upper_date', 'error']
+
+
+def window_grid(starts, ends):
+    return sorted((start, end) for start in starts for end in ends
+                  if pd.Timestamp(start) < pd.Timestamp(end))
+
+
+def window_distance(window, other):
+    # Days between the starts plus days between the ends
+    return (abs((pd.Timestamp(window[0]) - pd.Timestamp(other[0])).days)
+            + abs((pd.Timestamp(window[1]) - pd.Timestamp(other[1])).days))
+
+
+def window_initvals(window, n_switchpoints, lower, neighbour=None, medians=None):
+    # Starts from the posterior medians of a neighbouring window, moved to this
+    # window's start and kept strictly ordered inside its bounds; without one,
+    # from evenly spread switchpoints. K = 0 has only the rate.
+    size = (pd.Timestamp(window[1]) - pd.Timestamp(window[0])).days + 1
+    if n_switchpoints == 0:
+        return {'rate': np.sort(medians['rate']) if medians is not None else np.array([3.])}
+    if medians is None:
+        return {'switchpoint': np.linspace(lower, size, n_switchpoints + 2)[1:-1],
+                'rate': np.linspace(3, 10, n_switchpoints + 1)}
+
+    offset = (pd.Timestamp(window[0]) - pd.Timestamp(neighbour[0])).days
+    switchpoints = np.clip(np.sort(medians['switchpoint']) - offset, lower + 1, size - 2)
+    switchpoints = switchpoints + np.arange(n_switchpoints) * 1e-2
+    return {'switchpoint': switchpoints, 'rate': np.sort(medians['rate'])}
+
+
+def switchpoint_rows(idata, region, window, n_switchpoints):
+    # Posterior of each switchpoint, in days from the window start and as dates
+    if n_switchpoints == 0:
+        return []
+    quantiles = idata.posterior['switchpoint'].quantile((.025, .5, .975), dim=('chain', 'draw')).to_numpy()
+    start = pd.Timestamp(window[0])
+    rows = []
+    for idx in range(n_switchpoints):
+        row = {'region': region, 'start_date': window[0], 'end_date': window[1], 'switchpoint': idx}
+        for label, value in zip(('lower', 'median', 'upper'), quantiles[:, idx]):
+            row[label] = float(value)
+            row[f'{label}_date'] = (start + pd.Timedelta(days=int(round(value)))).strftime('%Y-%m-%d')
+        rows.append(row)
+    return rows
+
+
+def fit_window(region, lam, n_switchpoints, window, data, initvals, deaths, options):
+    kind = 'deaths' if deaths else 'daily'
+    name = f'switchpoints_{kind}_{n_switchpoints}_{region}_{window[0]}_{window[1]}'
+    if deaths:
+        idata = estimate_deaths_switchpoints(region=region, deaths_lambda=lam, start_date=window[0],
+                                             end_date=window[1], n_switchpoints=n_switchpoints,
+                                             initvals=initvals, data=data, name=name, **options)
+    else:
+        idata = estimate_daily_switchpoints(region=region, admissions_lambda=lam, start_date=window[0],
+                                            end_date=window[1], n_switchpoints=n_switchpoints,
+                                            initvals=initvals, data=data, name=name, **options)
+
+    medians = {var: np.atleast_1d(idata.posterior[var].median(dim=('chain', 'draw')).to_numpy())
+               for var in ('switchpoint', 'rate') if var in idata.posterior}
+    return window, medians, switchpoint_rows(idata, region, window, n_switchpoints)
+
+
+def window_sensitivity(region, lam, n_switchpoints, windows, deaths=False, n_workers=1, reuse_model=False,
+                       **options):
+    # Fits the switchpoint model on every (start_date, end_date) window, on
+    # n_workers processes. The data of all windows is read once and sliced here.
+    # Every window started after another finished is warm-started from the
+    # nearest finished one.
+    kind = 'deaths' if deaths else 'daily'
+    lower = 0 if deaths else 30
+    first = min(pd.Timestamp(start) for start, _ in windows)
+    last = max(pd.Timestamp(end) for _, end in windows)
+    cases, observed = load_data(region, first, last, deaths=deaths)
+
+    # The window replaces any end_date, and the per-region warm-start state
+    # assumes a single window. With reuse_model, windows of equal length share
+    # a compiled model.
+    options = {key: value for key, value in options.items() if key != 'end_date'}
+    options.update(warm_start=False, reuse_model=reuse_model)
+    context = multiprocessing.get_context('spawn')
+    pending = list(windows)
+    finished = {}
+    rows = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+        running = {}
+        while pending or running:
+            while pending and len(running) < n_workers:
+                window = pending.pop(0)
+                neighbour = min(finished, key=lambda other: window_distance(window, other), default=None)
+                initvals = window_initvals(window, n_switchpoints, lower, neighbour, finished.get(neighbour))
+                data = (cases.loc[window[0]:window[1]], observed.loc[window[0]:window[1]])
+                running[executor.submit(fit_window, region, lam, n_switchpoints, window, data,
+                                        initvals, deaths, options)] = window
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                window = running.pop(future)
+                try:
+                    _, medians, window_rows = future.result()
+                except Exception as error:
+                    # Recorded in the table; the other windows go on
+                    print(f'Window {window[0]} - {window[1]} failed: {error}')
+                    rows.append({'region': region, 'start_date': window[0], 'end_date': window[1],
+                                 'error': repr(error)})
+                    continue
+                finished[window] = medians
+                rows.extend(window_rows)
+
+    table = pd.DataFrame(rows, columns=TABLE_COLUMNS).sort_values(['start_date', 'end_date', 'switchpoint'])
+    table.to_csv(f'results/sensitivity_{kind}_{n_switchpoints}_{region}.csv', index=False)
+    print(table.to_string(index=False))
+
+    return table
@@ -0,0 +1,83 @@
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+from benchmark_models import SYNTHETIC_LAMBDA, synthetic_series
+from train import estimate_daily_switchpoints
+from warm_start import seed_warm_start
+
+
+# Short runs on synthetic data through the same entry points as main.py, to
+# catch code paths that only fail once sampling starts
+START_DATE = '2021-01-01'
+SIZE = 200
+DRAWS = 50
+
+
+def window(size):
+    end_date = (pd.Timestamp(START_DATE) + pd.Timedelta(days=size - 1)).strftime('%Y-%m-%d')
+    series = synthetic_series(size, 1)
+    return end_date, (series['cases'], series['admissions'])
+
+
+def estimate(size, **options):
+    end_date, data = window(size)
+    return estimate_daily_switchpoints('SMOKE', SYNTHETIC_LAMBDA['admissions'], START_DATE, end_date,
+                                       burn=DRAWS, draws=DRAWS, n_chains=2, n_switchpoints=1,
+                                       initvals={'switchpoint': [size / 2]}, data=data, **options)
+
+
+def reused_model():
+    # Twice, so the second run takes the cached model and its NUTS step
+    for _ in range(2):
+        estimate(SIZE, reuse_model=True)
+
+
+def warm_start():
+    # The first run stores the adaptation, the second samples with the stored
+    # mass matrix and step size
+    for _ in range(2):
+        estimate(SIZE, warm_start=True)
+
+
+def incremental():
+    # Two refreshes as main.py --incremental runs them: warm start seeded from
+    # the stored fit, adaptive sampling, and a window that grows with new data
+    adaptive = {'max_draws': 4 * DRAWS, 'rhat': 1.1, 'ess': 50, 'check_every': DRAWS}
+    for size in (SIZE, SIZE + 7, SIZE + 14):
+        seed_warm_start('daily_switchpoints', 'SMOKE_INCREMENTAL', 1, 'switchpoints_daily_1_SMOKE_INCREMENTAL')
+        end_date, data = window(size)
+        estimate_daily_switchpoints('SMOKE_INCREMENTAL', SYNTHETIC_LAMBDA['admissions'], START_DATE, end_date,
+                                    burn=DRAWS, draws=DRAWS, n_chains=2, n_switchpoints=1,
+                                    initvals={'switchpoint': [size / 2]}, data=data, warm_start=True,
+                                    adaptive=adaptive)
+
+
+SMOKE_TESTS = {
+    'reused_model': reused_model,
+    'warm_start': warm_start,
+    'incremental': incremental,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tests", type=str, nargs='+', default=list(SMOKE_TESTS), choices=list(SMOKE_TESTS))
+    args = parser.parse_args()
+
+    failed = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Results, manifests and warm starts go to a scratch results/ folder
+        os.chdir(directory)
+        for name in args.tests:
+            try:
+                SMOKE_TESTS[name]()
+                print(f'{name}: ok')
+            except Exception as error:
+                print(f'{name}: failed ({error!r})')
+                failed.append(name)
+
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,30 @@
+import numpy as np
+import pymc as pm
+import pytensor.tensor as pt
+
+
+def switchpoint_initval(n_switchpoints, lower, upper):
+    # The usual 350..550 starting days, moved inside (lower, upper) for short or
+    # narrowed windows and kept strictly increasing for the Ordered transform
+    return np.clip(np.linspace(350, 550, n_switchpoints), lower + 1, upper - 2) + np.arange(n_switchpoints) * 1e-2
+
+
+def build_switch(points, switchpoints, rates, n_switchpoints):
+    # Same curve as blending, for idx = 0..K-1, value = w_idx * rates[K-1-idx] + (1 - w_idx) * value
+    # starting from rates[K], but with all K sigmoids built in a single (K, N) op.
+    # Leading dimensions of switchpoints and rates (e.g. regions) are batched over.
+    if n_switchpoints == 0:
+        return rates[..., 0, None]
+
+    points = np.asarray(points)
+    arguments = 2 * (pt.as_tensor_variable(points) - switchpoints[..., :, None])
+    weights = pm.math.sigmoid(arguments)
+
+    # log prod_{j >= idx} (1 - w_j), as a reversed cumulative sum in log space so the
+    # gradient stays finite once a sigmoid saturates
+    log_kept = pt.cumsum(-pm.math.log1pexp(arguments)[..., ::-1, :], axis=-2)[..., ::-1, :]
+    kept_after = pt.exp(pt.concatenate([log_kept[..., 1:, :], pt.zeros_like(log_kept[..., :1, :])],
+                                       axis=-2))
+
+    value = pt.sum(weights * rates[..., n_switchpoints - 1::-1, None] * kept_after, axis=-2)
+    return value + rates[..., n_switchpoints, None] * pt.exp(log_kept[..., 0, :])
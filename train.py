@@ -1,4 +1,3 @@
-import pickle
 import pymc as pm
 import arviz as az
 import numpy as np
@@ -7,104 +6,242 @@ import matplotlib.pyplot as plt
 
 from model_weekly import weekly_switchpoints_model
 from plots import plot_daily_pH_training, plot_daily_switchpoints, plot_weekly_switchpoints
-from utils import load_data
+from utils import load_data, week_labels
 from model_daily import daily_admissions_model, daily_switchpoints_model
+from model_cache import cached_model
+from model_discrete import sample_discrete_switchpoints
+from sampling import sample_kwargs, approximate_posterior, chain_initvals
+from warm_start import load_warm_start, save_warm_start
+from result_store import save_result, save_summary, load_result, load_idata, result_groups
+from manifest import ManifestStage
+from predictive import stream_predictive, plot_predictive, summarize
+from profiling import profile_stage, profiled_sample_kwargs, profile_sampler_stats
 
 
 def train_daily_model(region, start_date='2020-06-29', end_date='2020-12-01',
-                      burn=4000, draws=5000, n_chains=4, verbose=False):
+                      burn=4000, draws=5000, n_chains=4, verbose=False, reuse_model=False,
+                      adaptive=None, sampler='pymc', warm_start=False, warm_tune=500,
+                      downcast=True, predictive='full', predictive_thin=1, resume=False):
     
+    profile_stage('data_load', 'train_daily')
     cases, hospitalized = load_data(region, start_date, end_date)
+    stage = ManifestStage('train_daily', region, {'start_date': start_date, 'end_date': end_date,
+                                                  'burn': burn, 'draws': draws, 'n_chains': n_chains,
+                                                  'adaptive': adaptive, 'sampler': sampler,
+                                                  'downcast': downcast, 'predictive': predictive,
+                                                  'predictive_thin': predictive_thin},
+                          (cases, hospitalized), f'train_daily_{region}')
+    if resume and stage.done():
+        profile_stage(None)
+        posterior = load_result(f'train_daily_{region}', 'posterior', ['pH', 'admissions_lambda'])
+        return float(posterior.pH.mean()), float(posterior.admissions_lambda.mean())
+    stage.start()
     
-
-    with daily_admissions_model(cases, hospitalized) as model:
+    profile_stage('graph_build', 'train_daily')
+    if reuse_model:
+        model, step = cached_model('daily_admissions', cases, hospitalized, target_accept=0.95)
+    else:
+        model, step = daily_admissions_model(cases, hospitalized), None
+
+    initvals = None
+    if warm_start:
+        initvals, step, burn = load_warm_start('daily_admissions', region, 0, model, step, burn,
+                                               warm_tune, target_accept=0.95)
+
+    profile_stage('sampling', 'train_daily')
+    with model:
          # Sample from the posterior
-        idata = pm.sample(draws=draws, tune=burn, chains=n_chains, 
-                          return_inferencedata=True, target_accept=0.95, idata_kwargs={"log_likelihood": True})
+        idata = pm.sample(**profiled_sample_kwargs(sample_kwargs(draws, n_chains, adaptive, sampler, step,
+                                                                 target_accept=0.95)),
+                          tune=burn, chains=n_chains,
+                          return_inferencedata=True,
+                          initvals=chain_initvals(model, initvals, n_chains, step),
+                          idata_kwargs={"log_likelihood": True, "include_transformed": warm_start})
+        profile_sampler_stats(idata, 'train_daily')
+        if warm_start:
+            save_warm_start('daily_admissions', region, 0, model, idata)
         
-        # Generate posterior predictive samples
-        idata.extend(pm.sample_posterior_predictive(idata))
-        print(f'data keys are : {idata.posterior_predictive.data_vars}')
+        profile_stage('posterior_predictive', 'train_daily')
+        if predictive == 'streaming':
+            stream_predictive(idata, 'admissions', model, predictive_thin)
+        else:
+            # Generate posterior predictive samples
+            idata.extend(pm.sample_posterior_predictive(idata))
+            print(f'data keys are : {idata.posterior_predictive.data_vars}')
 
 
         if verbose:
+            profile_stage('plotting', 'train_daily')
             az.summary(idata)
             az.plot_trace(idata)
 
             data = {
-                'admissions': idata.posterior_predictive['admissions'].stack(sample=('chain', 'draw')).to_numpy(),
+                **plot_predictive(idata, 'admissions', 'admissions', predictive),
                 'hospitalized': idata.observed_data['admissions'].to_numpy()
             }
 
 
             plot_daily_pH_training(data, start_date, end_date,region)
 
-    with open(f'results/train_daily_{region}.pickle', 'wb') as file:
-        pickle.dump(idata, file, protocol=pickle.HIGHEST_PROTOCOL)
+    profile_stage('saving', 'train_daily')
+    save_result(idata, f'train_daily_{region}', downcast)
+    save_summary(f'train_daily_{region}', summarize(idata, 'train_daily', region, start_date, end_date))
+    stage.finish()
+    profile_stage(None)
 
     return float(idata.posterior.pH.stack(sample=('chain', 'draw')).mean()), \
         float(idata.posterior.admissions_lambda.stack(sample=('chain', 'draw')).mean())
 
 
-def estimate_daily_switchpoints(region, admissions_lambda, start_date='2020-07-01',
+def switchpoint_start(region):
+    # Default start of the switchpoint window; Italy's admissions start later
+    return '2020-09-01' if region == 'Italy' else '2020-07-01'
+
+
+def estimate_daily_switchpoints(region, admissions_lambda, start_date=None,
                                 end_date='2022-03-27', burn=4000, draws=5000, n_chains=4,
-                                verbose=False, n_switchpoints=1):
-    if region == 'Italy':
-        start_date = '2020-09-01'
-    print('HE ENTRADO AL PROGRAMA')
-    cases, hospitalized = load_data(region, start_date, end_date)
-    print('\n HE CARGADO LOS DATOS')
+                                verbose=False, n_switchpoints=1, delay_method='conv',
+                                reuse_model=False, engine='sigmoid', adaptive=None,
+                                sampler='pymc', initvals=None, fast=None, warm_start=False, warm_tune=500,
+                                downcast=True, predictive='full', predictive_thin=1, resume=False,
+                                data=None, name=None, switchpoint_bounds=None,
+                                switchpoint_prior=None):
+    # data: (cases, admissions) already sliced to the window, instead of loading them;
+    # name: where to store the fit, by default one per region and K
+    # switchpoint_bounds, switchpoint_prior: narrower priors, see daily_switchpoints_model
+    start_date = start_date or switchpoint_start(region)
+    profile_stage('data_load', 'estimate_daily')
+    cases, hospitalized = data if data is not None else load_data(region, start_date, end_date)
+    name = name or f'switchpoints_daily_{n_switchpoints}_{region}'
+    stage = ManifestStage('estimate_daily', region, {'start_date': start_date, 'end_date': end_date,
+                                                     'burn': burn, 'draws': draws, 'n_chains': n_chains,
+                                                     'n_switchpoints': n_switchpoints,
+                                                     'admissions_lambda': admissions_lambda,
+                                                     'delay_method': delay_method, 'engine': engine,
+                                                     'adaptive': adaptive, 'sampler': sampler, 'fast': fast,
+                                                     'downcast': downcast, 'predictive': predictive,
+                                                     'predictive_thin': predictive_thin,
+                                                     'switchpoint_bounds': switchpoint_bounds,
+                                                     'switchpoint_prior': switchpoint_prior},
+                          (cases, hospitalized), name)
+    if resume and stage.done():
+        profile_stage(None)
+        return load_idata(name, result_groups(name))
+    stage.start()
     dict_init_values = {
         'switchpoint' : np.array(np.linspace(350, 550, n_switchpoints)),
         'rate' : np.array(np.linspace(3, 10, n_switchpoints + 1)),
         'sigma' : None,
         'admissions' : None
     }
-    with daily_switchpoints_model(cases, hospitalized, admissions_lambda, n_switchpoints) as model:
-        
-        idata = pm.sample(draws=draws, tune=burn, chains=n_chains,
-                          return_inferencedata=True, target_accept=0.99, idata_kwargs={"log_likelihood": True},initvals=dict_init_values)
-        idata.extend(pm.sample_posterior_predictive(idata))
-
-        if verbose:
-            az.summary(idata)
-            fig = az.plot_trace(idata)
-            plt.savefig(f'plots/trace_plot_{region}.png')
-
-            data = {
-                'admissions': idata.posterior_predictive['admissions'].stack(sample=('chain', 'draw')).to_numpy(),
-                'hospitalized': idata.observed_data['admissions'].to_numpy()
-            }
-
-            plot_daily_switchpoints(data, start_date, end_date, idata, n_switchpoints, region)
-
-    with open(f'results/switchpoints_daily_{n_switchpoints}_{region}.pickle', 'wb') as file:
-        pickle.dump(idata, file, protocol=pickle.HIGHEST_PROTOCOL)
-
-
-def estimate_weekly_switchpoints(region, start_date='2020-07-01', end_date='2022-03-27',
+    if initvals is not None:
+        dict_init_values.update(initvals)
+    if n_switchpoints == 0:
+        # The K = 0 model has no switchpoint variable
+        dict_init_values.pop('switchpoint')
+    if engine == 'discrete':
+        profile_stage('sampling', 'estimate_daily')
+        idata = sample_discrete_switchpoints(cases, hospitalized, admissions_lambda, n_switchpoints,
+                                             'admissions', lower=30, tune=burn, chains=n_chains,
+                                             **profiled_sample_kwargs(sample_kwargs(draws, n_chains,
+                                                                                    adaptive, sampler)))
+        profile_sampler_stats(idata, 'estimate_daily')
+        profile_stage('posterior_predictive', 'estimate_daily')
+        if predictive == 'streaming':
+            stream_predictive(idata, 'admissions', thin=predictive_thin)
+    else:
+        profile_stage('graph_build', 'estimate_daily')
+        # The cached models have the priors of the whole window built in
+        if reuse_model and switchpoint_bounds is None and switchpoint_prior is None:
+            model, step = cached_model('daily_switchpoints', cases, hospitalized, n_switchpoints,
+                                       admissions_lambda, delay_method, target_accept=0.99)
+        else:
+            model = daily_switchpoints_model(cases, hospitalized, admissions_lambda, n_switchpoints,
+                                             delay_method=delay_method, switchpoint_bounds=switchpoint_bounds,
+                                             switchpoint_prior=switchpoint_prior)
+            step = None
+
+        if warm_start and not fast:
+            stored, step, burn = load_warm_start('daily_switchpoints', region, n_switchpoints, model,
+                                                 step, burn, warm_tune, target_accept=0.99)
+            dict_init_values.update(stored or {})
+
+        profile_stage('sampling', 'estimate_daily')
+        with model:
+            if fast:
+                # Screening: draws from an approximation instead of NUTS
+                idata = approximate_posterior(model, draws, fast, dict_init_values)
+            else:
+                idata = pm.sample(**profiled_sample_kwargs(sample_kwargs(draws, n_chains, adaptive, sampler, step,
+                                                                         target_accept=0.99)),
+                                  tune=burn, chains=n_chains,
+                                  return_inferencedata=True,
+                                  initvals=chain_initvals(model, dict_init_values, n_chains, step),
+                                  idata_kwargs={"log_likelihood": True, "include_transformed": warm_start})
+                profile_sampler_stats(idata, 'estimate_daily')
+                if warm_start:
+                    save_warm_start('daily_switchpoints', region, n_switchpoints, model, idata)
+            profile_stage('posterior_predictive', 'estimate_daily')
+            if predictive == 'streaming':
+                stream_predictive(idata, 'admissions', model, predictive_thin)
+            else:
+                idata.extend(pm.sample_posterior_predictive(idata))
+
+    if verbose:
+        profile_stage('plotting', 'estimate_daily')
+        az.summary(idata)
+        fig = az.plot_trace(idata)
+        plt.savefig(f'plots/trace_plot_{region}.png')
+
+        data = {
+            **plot_predictive(idata, 'admissions', 'admissions', predictive),
+            'hospitalized': idata.observed_data['admissions'].to_numpy()
+        }
+
+        plot_daily_switchpoints(data, start_date, end_date, idata, n_switchpoints, region)
+
+    profile_stage('saving', 'estimate_daily')
+    save_result(idata, name, downcast)
+    save_summary(name, summarize(idata, 'daily', region, start_date, end_date, n_switchpoints))
+    stage.finish()
+    profile_stage(None)
+
+    return idata
+
+
+def estimate_weekly_switchpoints(region, start_date=None, end_date='2022-03-27',
                                  burn=2000, draws=5000, n_chains=4, verbose=False,
-                                 n_switchpoints=1):
-
-    cases, hospitalized = load_data(region, start_date, end_date, True)
-
-    with weekly_switchpoints_model(cases, hospitalized, n_switchpoints) as model:
-        idata = pm.sample(draws=draws, tune=burn, chains=n_chains,
+                                 n_switchpoints=1, adaptive=None, sampler='pymc', downcast=True,
+                                 deaths=False):
+    # Switchpoints on weekly totals: about 7x shorter series and no delay, so a
+    # cheap first pass for the daily fits (see coarse_to_fine.py)
+    start_date = start_date or switchpoint_start(region)
+    name = 'deaths' if deaths else 'admissions'
+    cases, observed = load_data(region, start_date, end_date, True, deaths=deaths)
+
+    with weekly_switchpoints_model(cases, observed, n_switchpoints, name) as model:
+        idata = pm.sample(**sample_kwargs(draws, n_chains, adaptive, sampler), tune=burn, chains=n_chains,
                           idata_kwargs={"log_likelihood": True})
 
         pm.sample_posterior_predictive(idata, extend_inferencedata=True)
 
-        if verbose:
+        if verbose and not deaths:
             az.summary(idata)
             az.plot_trace(idata)
 
             data = {
-                'admissions': idata.posterior['posterior_predictive']
-                .stack(sample=('chain', 'draw'))['admissions'].to_numpy(),
-                'hospitalized': idata.posterior['observed_data']['admissions'].to_numpy()
+                'admissions': idata.posterior_predictive['admissions']
+                .stack(sample=('chain', 'draw')).to_numpy(),
+                'hospitalized': idata.observed_data['admissions'].to_numpy()
             }
 
-            plot_weekly_switchpoints(data, start_date, end_date, idata, n_switchpoints)
+            plot_weekly_switchpoints(data, start_date, end_date, idata, n_switchpoints, region)
+
+    result_name = f'switchpoints_weekly_{"deaths_" if deaths else ""}{n_switchpoints}_{region}'
+    save_result(idata, result_name, downcast)
+    if not deaths:
+        last_week = week_labels(start_date, end_date)[-1]
+        save_summary(result_name, summarize(idata, 'weekly', region, start_date, last_week,
+                                            n_switchpoints, freq='W-MON'))
 
-    with open(f'results/switchpoints_weekly_{n_switchpoints}_{region}.pickle', 'wb') as file:
-        pickle.dump(idata, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return idata
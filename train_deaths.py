@@ -1,34 +1,78 @@
-import pickle
 import pymc as pm
 import arviz as az
 from plots import plot_daily_pD_training, plot_deaths_switchpoints
 from utils import load_data
 from model_deaths import daily_deaths_model, deaths_switchpoints_model
+from model_cache import cached_model
+from model_discrete import sample_discrete_switchpoints
+from sampling import sample_kwargs, approximate_posterior, chain_initvals
+from warm_start import load_warm_start, save_warm_start
+from result_store import save_result, save_summary, load_result, load_idata, result_groups
+from manifest import ManifestStage
+from profiling import profile_stage, profiled_sample_kwargs, profile_sampler_stats
+from predictive import stream_predictive, plot_predictive, summarize
 
 
 def train_deaths_model(region, start_date='2020-06-29', end_date='2020-12-01',
-                       burn=2000, draws=5000, n_chains=4, verbose=False):
+                       burn=2000, draws=5000, n_chains=4, verbose=False, reuse_model=False,
+                       adaptive=None, sampler='pymc', warm_start=False, warm_tune=500,
+                       downcast=True, predictive='full', predictive_thin=1, resume=False):
+    profile_stage('data_load', 'train_deaths')
     cases, deaths = load_data(region, start_date, end_date, deaths=True)
-
-    with daily_deaths_model(cases, deaths) as model:
-        idata = pm.sample(draws=draws, tune=burn, chains=n_chains,
-                          idata_kwargs={"log_likelihood": True})
-        pm.sample_posterior_predictive(idata, extend_inferencedata=True)
+    stage = ManifestStage('train_deaths', region, {'start_date': start_date, 'end_date': end_date,
+                                                   'burn': burn, 'draws': draws, 'n_chains': n_chains,
+                                                   'adaptive': adaptive, 'sampler': sampler,
+                                                   'downcast': downcast, 'predictive': predictive,
+                                                   'predictive_thin': predictive_thin},
+                          (cases, deaths), f'train_deaths_{region}')
+    if resume and stage.done():
+        profile_stage(None)
+        posterior = load_result(f'train_deaths_{region}', 'posterior', ['pD', 'deaths_lambda'])
+        return float(posterior.pD.mean()), float(posterior.deaths_lambda.mean())
+    stage.start()
+
+    profile_stage('graph_build', 'train_deaths')
+    if reuse_model:
+        model, step = cached_model('daily_deaths', cases, deaths)
+    else:
+        model, step = daily_deaths_model(cases, deaths), None
+
+    initvals = None
+    if warm_start:
+        initvals, step, burn = load_warm_start('daily_deaths', region, 0, model, step, burn, warm_tune)
+
+    profile_stage('sampling', 'train_deaths')
+    with model:
+        idata = pm.sample(**profiled_sample_kwargs(sample_kwargs(draws, n_chains, adaptive, sampler, step)),
+                          tune=burn, chains=n_chains,
+                          initvals=chain_initvals(model, initvals, n_chains, step),
+                          idata_kwargs={"log_likelihood": True, "include_transformed": warm_start})
+        profile_sampler_stats(idata, 'train_deaths')
+        if warm_start:
+            save_warm_start('daily_deaths', region, 0, model, idata)
+        profile_stage('posterior_predictive', 'train_deaths')
+        if predictive == 'streaming':
+            stream_predictive(idata, 'deaths', model, predictive_thin)
+        else:
+            pm.sample_posterior_predictive(idata, extend_inferencedata=True)
 
         if verbose:
+            profile_stage('plotting', 'train_deaths')
             az.summary(idata)
             az.plot_trace(idata)
 
             data = {
-                'deaths_estimated': idata.posterior['posterior_predictive']
-                .stack(sample=('chain', 'draw'))['deaths'].to_numpy(),
-                'deaths_observed': idata.posterior['observed_data']['deaths'].to_numpy()
+                **plot_predictive(idata, 'deaths', 'deaths_estimated', predictive),
+                'deaths_observed': idata.observed_data['deaths'].to_numpy()
             }
 
-            plot_daily_pD_training(data, start_date, end_date)
+            plot_daily_pD_training(data, start_date, end_date, region)
 
-    with open(f'results/train_deaths_{region}.pickle', 'wb') as file:
-        pickle.dump(idata, file, protocol=pickle.HIGHEST_PROTOCOL)
+    profile_stage('saving', 'train_deaths')
+    save_result(idata, f'train_deaths_{region}', downcast)
+    save_summary(f'train_deaths_{region}', summarize(idata, 'train_deaths', region, start_date, end_date))
+    stage.finish()
+    profile_stage(None)
 
     return float(idata.posterior.pD.stack(sample=('chain', 'draw')).mean()), \
         float(idata.posterior.deaths_lambda.stack(sample=('chain', 'draw')).mean())
@@ -36,26 +80,97 @@ def train_deaths_model(region, start_date='2020-06-29', end_date='2020-12-01',
 
 def estimate_deaths_switchpoints(region, deaths_lambda, start_date='2020-07-01',
                                  end_date='2022-03-27', burn=2000, draws=5000, n_chains=4,
-                                 verbose=False, n_switchpoints=1):
-
-    cases, deaths = load_data(region, start_date, end_date, deaths=True)
-
-    with deaths_switchpoints_model(cases, deaths, deaths_lambda, n_switchpoints) as model:
-        idata = pm.sample(draws=draws, tune=burn, chains=n_chains,
-                          idata_kwargs={"log_likelihood": True})
-        pm.sample_posterior_predictive(idata, extend_inferencedata=True)
-
-        if verbose:
-            az.summary(idata)
-            az.plot_trace(idata)
-
-            data = {
-                'deaths_estimated': idata.posterior['posterior_predictive']
-                .stack(sample=('chain', 'draw'))['deaths'].to_numpy(),
-                'deaths_observed': idata.posterior['observed_data']['deaths'].to_numpy()
-            }
-
-            plot_deaths_switchpoints(data, start_date, end_date, idata, n_switchpoints)
-
-    with open(f'results/switchpoints_deaths_{n_switchpoints}_{region}.pickle', 'wb') as file:
-        pickle.dump(idata, file, protocol=pickle.HIGHEST_PROTOCOL)
+                                 verbose=False, n_switchpoints=1, delay_method='conv',
+                                 reuse_model=False, engine='sigmoid', adaptive=None,
+                                 sampler='pymc', initvals=None, fast=None, warm_start=False, warm_tune=500,
+                                 downcast=True, predictive='full', predictive_thin=1, resume=False,
+                                 data=None, name=None, switchpoint_bounds=None,
+                                 switchpoint_prior=None):
+    # data, name and the switchpoint priors as in train.estimate_daily_switchpoints
+    profile_stage('data_load', 'estimate_deaths')
+    cases, deaths = data if data is not None else load_data(region, start_date, end_date, deaths=True)
+    name = name or f'switchpoints_deaths_{n_switchpoints}_{region}'
+    stage = ManifestStage('estimate_deaths', region, {'start_date': start_date, 'end_date': end_date,
+                                                      'burn': burn, 'draws': draws, 'n_chains': n_chains,
+                                                      'n_switchpoints': n_switchpoints,
+                                                      'deaths_lambda': deaths_lambda,
+                                                      'delay_method': delay_method, 'engine': engine,
+                                                      'adaptive': adaptive, 'sampler': sampler, 'fast': fast,
+                                                      'downcast': downcast, 'predictive': predictive,
+                                                      'predictive_thin': predictive_thin,
+                                                      'switchpoint_bounds': switchpoint_bounds,
+                                                      'switchpoint_prior': switchpoint_prior},
+                          (cases, deaths), name)
+    if resume and stage.done():
+        profile_stage(None)
+        return load_idata(name, result_groups(name))
+    stage.start()
+    if n_switchpoints == 0 and initvals is not None:
+        # The K = 0 model has no switchpoint variable
+        initvals = {key: value for key, value in initvals.items() if key != 'switchpoint'}
+
+    if engine == 'discrete':
+        profile_stage('sampling', 'estimate_deaths')
+        idata = sample_discrete_switchpoints(cases, deaths, deaths_lambda, n_switchpoints,
+                                             'deaths', lower=0, tune=burn, chains=n_chains,
+                                             **profiled_sample_kwargs(sample_kwargs(draws, n_chains,
+                                                                                    adaptive, sampler)))
+        profile_sampler_stats(idata, 'estimate_deaths')
+        profile_stage('posterior_predictive', 'estimate_deaths')
+        if predictive == 'streaming':
+            stream_predictive(idata, 'deaths', thin=predictive_thin)
+    else:
+        profile_stage('graph_build', 'estimate_deaths')
+        # The cached models have the priors of the whole window built in
+        if reuse_model and switchpoint_bounds is None and switchpoint_prior is None:
+            model, step = cached_model('deaths_switchpoints', cases, deaths, n_switchpoints,
+                                       deaths_lambda, delay_method)
+        else:
+            model = deaths_switchpoints_model(cases, deaths, deaths_lambda, n_switchpoints,
+                                              delay_method=delay_method, switchpoint_bounds=switchpoint_bounds,
+                                              switchpoint_prior=switchpoint_prior)
+            step = None
+
+        if warm_start and not fast:
+            stored, step, burn = load_warm_start('deaths_switchpoints', region, n_switchpoints, model,
+                                                 step, burn, warm_tune)
+            initvals = dict(initvals or {}, **(stored or {}))
+
+        profile_stage('sampling', 'estimate_deaths')
+        with model:
+            if fast:
+                # Screening: draws from an approximation instead of NUTS
+                idata = approximate_posterior(model, draws, fast, initvals)
+            else:
+                idata = pm.sample(**profiled_sample_kwargs(sample_kwargs(draws, n_chains, adaptive, sampler, step)),
+                                  tune=burn, chains=n_chains,
+                                  initvals=chain_initvals(model, initvals, n_chains, step),
+                                  idata_kwargs={"log_likelihood": True, "include_transformed": warm_start})
+                profile_sampler_stats(idata, 'estimate_deaths')
+                if warm_start:
+                    save_warm_start('deaths_switchpoints', region, n_switchpoints, model, idata)
+            profile_stage('posterior_predictive', 'estimate_deaths')
+            if predictive == 'streaming':
+                stream_predictive(idata, 'deaths', model, predictive_thin)
+            else:
+                pm.sample_posterior_predictive(idata, extend_inferencedata=True)
+
+    if verbose:
+        profile_stage('plotting', 'estimate_deaths')
+        az.summary(idata)
+        az.plot_trace(idata)
+
+        data = {
+            **plot_predictive(idata, 'deaths', 'deaths_estimated', predictive),
+            'deaths_observed': idata.observed_data['deaths'].to_numpy()
+        }
+
+        plot_deaths_switchpoints(data, start_date, end_date, idata, n_switchpoints, region)
+
+    profile_stage('saving', 'estimate_deaths')
+    save_result(idata, name, downcast)
+    save_summary(name, summarize(idata, 'deaths', region, start_date, end_date, n_switchpoints))
+    stage.finish()
+    profile_stage(None)
+
+    return idata
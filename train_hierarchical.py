@@ -0,0 +1,38 @@
+import pymc as pm
+import arviz as az
+
+from model_hierarchical import load_regions, hierarchical_switchpoints_model
+from predictive import stream_predictive
+from result_store import save_result
+from sampling import sample_kwargs
+
+
+def estimate_hierarchical_switchpoints(regions, lambdas, start_date='2020-07-01',
+                                       end_date='2022-03-27', burn=4000, draws=5000, n_chains=4,
+                                       verbose=False, n_switchpoints=1, deaths=False, adaptive=None,
+                                       sampler='pymc', downcast=True, predictive='full',
+                                       predictive_thin=1):
+    # One joint fit replacing the per-region switchpoint fits; lambdas are the
+    # delay rates from each region's training fit, in the order of regions
+    name = 'deaths' if deaths else 'admissions'
+    cases, observed, mask = load_regions(regions, start_date, end_date, deaths)
+
+    model = hierarchical_switchpoints_model(regions, cases, observed, mask, lambdas, n_switchpoints,
+                                            name=name, lower=0 if deaths else 30)
+
+    with model:
+        idata = pm.sample(**sample_kwargs(draws, n_chains, adaptive, sampler), tune=burn, chains=n_chains,
+                          target_accept=0.95 if deaths else 0.99,
+                          idata_kwargs={"log_likelihood": True})
+        if predictive == 'streaming':
+            stream_predictive(idata, name, model, predictive_thin)
+        else:
+            pm.sample_posterior_predictive(idata, extend_inferencedata=True)
+
+    if verbose:
+        print(az.summary(idata, var_names=['switchpoint', 'rate'], filter_vars='like'))
+
+    kind = 'deaths' if deaths else 'daily'
+    save_result(idata, f'switchpoints_{kind}_{n_switchpoints}_joint', downcast)
+
+    return idata
@@ -0,0 +1,138 @@
+import pymc as pm
+import arviz as az
+
+from plots import plot_daily_pH_training, plot_daily_pD_training, plot_daily_switchpoints, \
+    plot_deaths_switchpoints
+from utils import load_joint_data
+from model_joint import OUTCOMES, joint_training_model, joint_switchpoints_model, outcome_view
+from predictive import stream_predictive, plot_predictive, summarize
+from result_store import save_result, save_summary, load_result, load_idata, result_groups
+from manifest import ManifestStage
+from sampling import sample_kwargs, approximate_posterior
+from profiling import profile_stage, profiled_sample_kwargs, profile_sampler_stats
+
+
+def joint_predictive(idata, model, predictive, predictive_thin):
+    if predictive == 'streaming':
+        for outcome in OUTCOMES:
+            stream_predictive(idata, outcome, model, predictive_thin)
+    else:
+        pm.sample_posterior_predictive(idata, model=model, extend_inferencedata=True)
+
+
+def train_joint_model(region, start_date='2020-06-29', end_date='2020-12-01',
+                      burn=4000, draws=5000, n_chains=4, verbose=False, adaptive=None,
+                      sampler='pymc', downcast=True, predictive='full', predictive_thin=1,
+                      resume=False):
+    # Calibrates pH, pD and both delays in one run instead of train_daily_model
+    # followed by train_deaths_model
+    profile_stage('data_load', 'train_both')
+    cases, hospitalized, deaths = load_joint_data(region, start_date, end_date)
+    stage = ManifestStage('train_both', region, {'start_date': start_date, 'end_date': end_date,
+                                                 'burn': burn, 'draws': draws, 'n_chains': n_chains,
+                                                 'adaptive': adaptive, 'sampler': sampler,
+                                                 'downcast': downcast, 'predictive': predictive,
+                                                 'predictive_thin': predictive_thin},
+                          (cases, hospitalized, deaths), f'train_both_{region}')
+    if resume and stage.done():
+        profile_stage(None)
+        posterior = load_result(f'train_both_{region}', 'posterior').mean(dim=('chain', 'draw'))
+        return float(posterior.pH), float(posterior.pD), \
+            float(posterior.admissions_lambda), float(posterior.deaths_lambda)
+    stage.start()
+
+    profile_stage('graph_build', 'train_both')
+    with joint_training_model(cases, hospitalized, deaths) as model:
+        profile_stage('sampling', 'train_both')
+        idata = pm.sample(**profiled_sample_kwargs(sample_kwargs(draws, n_chains, adaptive, sampler)),
+                          tune=burn, chains=n_chains, target_accept=0.95,
+                          idata_kwargs={"log_likelihood": True})
+        profile_sampler_stats(idata, 'train_both')
+        profile_stage('posterior_predictive', 'train_both')
+        joint_predictive(idata, model, predictive, predictive_thin)
+
+    if verbose:
+        profile_stage('plotting', 'train_both')
+        az.summary(idata)
+
+        plot_daily_pH_training({
+            **plot_predictive(idata, 'admissions', 'admissions', predictive),
+            'hospitalized': idata.observed_data['admissions'].to_numpy()
+        }, start_date, end_date, region)
+        plot_daily_pD_training({
+            **plot_predictive(idata, 'deaths', 'deaths_estimated', predictive),
+            'deaths_observed': idata.observed_data['deaths'].to_numpy()
+        }, start_date, end_date, region)
+
+    profile_stage('saving', 'train_both')
+    save_result(idata, f'train_both_{region}', downcast)
+    for outcome in OUTCOMES:
+        save_summary(f'train_both_{region}_{outcome}',
+                     summarize(idata, f'train_both_{outcome}', region, start_date, end_date))
+    stage.finish()
+    profile_stage(None)
+
+    posterior = idata.posterior.mean(dim=('chain', 'draw'))
+    return float(posterior.pH), float(posterior.pD), \
+        float(posterior.admissions_lambda), float(posterior.deaths_lambda)
+
+
+def estimate_joint_switchpoints(region, admissions_lambda, deaths_lambda, start_date='2020-07-01',
+                                end_date='2022-03-27', burn=4000, draws=5000, n_chains=4,
+                                verbose=False, n_switchpoints=1, adaptive=None, sampler='pymc',
+                                fast=None, downcast=True, predictive='full', predictive_thin=1,
+                                resume=False):
+    # estimate_daily_switchpoints and estimate_deaths_switchpoints in one run
+    profile_stage('data_load', 'estimate_both')
+    cases, hospitalized, deaths = load_joint_data(region, start_date, end_date)
+    name = f'switchpoints_both_{n_switchpoints}_{region}'
+    stage = ManifestStage('estimate_both', region, {'start_date': start_date, 'end_date': end_date,
+                                                    'burn': burn, 'draws': draws, 'n_chains': n_chains,
+                                                    'n_switchpoints': n_switchpoints,
+                                                    'admissions_lambda': admissions_lambda,
+                                                    'deaths_lambda': deaths_lambda,
+                                                    'adaptive': adaptive, 'sampler': sampler, 'fast': fast,
+                                                    'downcast': downcast, 'predictive': predictive,
+                                                    'predictive_thin': predictive_thin},
+                          (cases, hospitalized, deaths), name)
+    if resume and stage.done():
+        profile_stage(None)
+        return load_idata(name, result_groups(name))
+    stage.start()
+
+    profile_stage('graph_build', 'estimate_both')
+    with joint_switchpoints_model(cases, hospitalized, deaths, admissions_lambda, deaths_lambda,
+                                  n_switchpoints) as model:
+        profile_stage('sampling', 'estimate_both')
+        if fast:
+            idata = approximate_posterior(model, draws, fast)
+        else:
+            idata = pm.sample(**profiled_sample_kwargs(sample_kwargs(draws, n_chains, adaptive, sampler)),
+                              tune=burn, chains=n_chains, target_accept=0.99,
+                              idata_kwargs={"log_likelihood": True})
+            profile_sampler_stats(idata, 'estimate_both')
+        profile_stage('posterior_predictive', 'estimate_both')
+        joint_predictive(idata, model, predictive, predictive_thin)
+
+    if verbose:
+        profile_stage('plotting', 'estimate_both')
+        az.summary(idata)
+
+        plot_daily_switchpoints({
+            **plot_predictive(idata, 'admissions', 'admissions', predictive),
+            'hospitalized': idata.observed_data['admissions'].to_numpy()
+        }, start_date, end_date, outcome_view(idata, 'admissions'), n_switchpoints, region)
+        plot_deaths_switchpoints({
+            **plot_predictive(idata, 'deaths', 'deaths_estimated', predictive),
+            'deaths_observed': idata.observed_data['deaths'].to_numpy()
+        }, start_date, end_date, outcome_view(idata, 'deaths'), n_switchpoints, region)
+
+    profile_stage('saving', 'estimate_both')
+    save_result(idata, name, downcast)
+    for outcome in OUTCOMES:
+        save_summary(f'{name}_{outcome}', summarize(idata, f'both_{outcome}', region, start_date, end_date,
+                                                    n_switchpoints, switchpoints=outcome_view(idata, outcome)))
+    stage.finish()
+    profile_stage(None)
+
+    return idata
@@ -1,7 +1,16 @@
+import hashlib
+import json
+import os
 from datetime import timedelta
+import numpy as np
 import pandas as pd
 
 
+SPANISH_SOURCE = 'data/casos_hosp_uci_def_sexo_edad_provres.csv'
+SPANISH_CACHE = 'data/cache/spanish'
+SPANISH_COLUMNS = ['num_casos', 'num_hosp', 'num_def']
+
+
 def load_data(region, start_date, end_date, aggregate_week=False, deaths=False):
 
     start_date = pd.to_datetime(start_date)
@@ -15,9 +24,37 @@ def load_data(region, start_date, end_date, aggregate_week=False, deaths=False):
     return cases, hospitalized
 
 
+def week_labels(start_date, end_date):
+    # Dates of the weeks load_data(..., aggregate_week=True) returns: each week
+    # ends on, and is labelled by, a Monday
+    return pd.date_range(start_date, pd.to_datetime(end_date) + timedelta(days=6), freq='W-MON')
+
+
+def load_joint_data(region, start_date, end_date):
+    # Cases, admissions and deaths from a single read; deaths are only available
+    # for the Spanish regions
+    if not (len(region) == 2 or region == 'Spain'):
+        raise Exception('joint admissions and deaths data only available for Spanish regions')
+
+    data = spanish_table(region, pd.to_datetime(start_date), pd.to_datetime(end_date), False)
+    return data['num_casos'], data['num_hosp'], data['num_def']
+
+
 def load_spanish(region, start_date, end_date, aggregate_week, deaths):
-    # Subset provinces
-    provinces = pd.read_csv('data/provinces_iso.csv')
+    data = spanish_table(region, start_date, end_date, aggregate_week)
+
+    cases = data['num_casos']
+    if not deaths:
+        pred = data['num_hosp']
+    else:
+        pred = data['num_def']
+
+    return cases, pred
+
+
+def spanish_table(region, start_date, end_date, aggregate_week):
+    # Subset provinces ('NA' is Navarra, not a missing value)
+    provinces = pd.read_csv('data/provinces_iso.csv', keep_default_na=False, na_values=[''])
     if region == 'Spain':
         provinces = provinces['province_iso']
     else:
@@ -27,23 +64,139 @@ def load_spanish(region, start_date, end_date, aggregate_week, deaths):
         provinces = provinces.loc[provinces['ccaa_iso'] == region]['province_iso']
 
     # Load data
-    data = pd.read_csv('data/casos_hosp_uci_def_sexo_edad_provres.csv')
-    data = data[data.provincia_iso.isin(provinces)]
-    data['fecha'] = pd.to_datetime(data['fecha'])
-    data = data.groupby('fecha').sum(['num_casos', 'num_hosp', 'num_def'])
+    dates, cached_provinces, tables = load_spanish_cache()
+    rows = np.flatnonzero(np.isin(cached_provinces, provinces.values))
+    data = pd.DataFrame({column: np.asarray(tables[column][rows]).sum(axis=0)
+                         for column in SPANISH_COLUMNS},
+                        index=pd.DatetimeIndex(dates, name='fecha'))
 
     # Extract values
     data = data.loc[start_date:end_date]
     if aggregate_week:
         data = data.groupby(pd.Grouper(freq='W-MON'))[['num_casos', 'num_hosp', 'num_def']].sum()
 
-    cases = data['num_casos']
-    if not deaths:
-        pred = data['num_hosp']
-    else:
-        pred = data['num_def']
+    return data
 
-    return cases, pred
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return {'source': path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def file_hash(path, size):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while size > 0:
+            chunk = file.read(min(size, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.hexdigest()
+
+
+def aggregate_spanish(data):
+    # Sum the sex/age breakdown into one (province x date) table per column
+    data = data.groupby(['provincia_iso', 'fecha'])[SPANISH_COLUMNS].sum()
+    return {column: data[column].unstack(fill_value=0) for column in SPANISH_COLUMNS}
+
+
+def build_spanish_cache(source=SPANISH_SOURCE, cache=SPANISH_CACHE):
+    data = pd.read_csv(source, usecols=['provincia_iso', 'fecha'] + SPANISH_COLUMNS,
+                       keep_default_na=False, na_values=[''])
+    write_spanish_cache(aggregate_spanish(data), source, cache)
+
+
+def update_spanish_cache(meta, source=SPANISH_SOURCE, cache=SPANISH_CACHE):
+    # When new rows were only appended to the source, parse just those rows and
+    # add them to the cached tables. Returns False if a full rebuild is needed.
+    size = meta.get('size', 0)
+    if 'sha1' not in meta or os.stat(source).st_size <= size:
+        return False
+
+    with open(source, 'rb') as file:
+        header = file.readline().decode().strip().split(',')
+        file.seek(size - 1)
+        if file.read(1) != b'\n':
+            return False
+    if file_hash(source, size) != meta['sha1']:
+        return False
+
+    with open(source, 'rb') as file:
+        file.seek(size)
+        data = pd.read_csv(file, header=None, names=header,
+                           usecols=['provincia_iso', 'fecha'] + SPANISH_COLUMNS,
+                           keep_default_na=False, na_values=[''])
+
+    dates, provinces, tables = read_spanish_cache(cache)
+    new_tables = aggregate_spanish(data)
+    merged = {}
+    for column in SPANISH_COLUMNS:
+        table = pd.DataFrame(np.asarray(tables[column]), index=provinces,
+                             columns=pd.to_datetime(dates).strftime('%Y-%m-%d'))
+        merged[column] = (table.add(new_tables[column], fill_value=0)
+                          .fillna(0).sort_index().sort_index(axis=1).astype('int64'))
+
+    write_spanish_cache(merged, source, cache)
+    return True
+
+
+def write_spanish_cache(tables, source=SPANISH_SOURCE, cache=SPANISH_CACHE):
+    os.makedirs(cache, exist_ok=True)
+    for column, table in tables.items():
+        save_array(os.path.join(cache, f'{column}.npy'), table.to_numpy())
+    save_array(os.path.join(cache, 'provinces.npy'), table.index.to_numpy().astype(str))
+    save_array(os.path.join(cache, 'dates.npy'),
+               pd.to_datetime(table.columns).to_numpy().astype('datetime64[D]'))
+
+    # Written last, so an interrupted build is never considered valid
+    stamp = source_stamp(source)
+    stamp['sha1'] = file_hash(source, stamp['size'])
+    tmp_path = os.path.join(cache, f'meta.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(stamp, file)
+    os.replace(tmp_path, os.path.join(cache, 'meta.json'))
+
+
+def load_spanish_cache(source=SPANISH_SOURCE, cache=SPANISH_CACHE):
+    try:
+        with open(os.path.join(cache, 'meta.json')) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        meta = {}
+
+    stamp = source_stamp(source)
+    if any(meta.get(key) != value for key, value in stamp.items()):
+        if not update_spanish_cache(meta, source, cache):
+            build_spanish_cache(source, cache)
+
+    return read_spanish_cache(cache)
+
+
+def read_spanish_cache(cache=SPANISH_CACHE):
+    dates = np.load(os.path.join(cache, 'dates.npy'))
+    provinces = np.load(os.path.join(cache, 'provinces.npy'))
+    tables = {column: np.load(os.path.join(cache, f'{column}.npy'), mmap_mode='r')
+              for column in SPANISH_COLUMNS}
+
+    return dates, provinces, tables
+
+
+def latest_date(region):
+    # Last day with data for a region, used to extend estimation windows
+    if len(region) == 2 or region == 'Spain':
+        dates, _, _ = load_spanish_cache()
+        return pd.Timestamp(dates.max())
+
+    data = pd.read_csv('data/OWID/new_cases.csv', usecols=['date', region]).dropna()
+    return pd.to_datetime(data['date']).max()
+
+
+def save_array(path, array):
+    # np.save appends .npy to names without it, so keep the suffix on the temporary file
+    tmp_path = f'{path[:-4]}.{os.getpid()}.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
 
 
 def load_ecdc(region, start_date, end_date, aggregate_week, deaths):
@@ -80,16 +233,16 @@ def load_ecdc(region, start_date, end_date, aggregate_week, deaths):
 
 def load_owid(region, start_date, end_date, aggregate_week, deaths):
     # Load cases
-    data = pd.read_csv('data/OWID/new_cases.csv')
-    data = pd.melt(data, id_vars=['date'], var_name='country', value_name='cases')
-    data = data.loc[data['country'] == region]
+    data = pd.read_csv('data/OWID/new_cases.csv', usecols=['date', region])
+    data = data.rename(columns={region: 'cases'})
     data['date'] = pd.to_datetime(data['date'])
     data = data.set_index('date').sort_index()
     data = data.loc[start_date:end_date]
     cases = data['cases']
 
     # Load hospitalizations
-    data = pd.read_csv('data/OWID/covid-hospitalizations.csv')
+    data = pd.read_csv('data/OWID/covid-hospitalizations.csv',
+                       usecols=['entity', 'date', 'indicator', 'value'])
     data = data.loc[data['entity'] == region]
     data = data.loc[data['indicator'] == 'Weekly new hospital admissions']
     data['date'] = pd.to_datetime(data['date'])
@@ -101,21 +254,27 @@ def load_owid(region, start_date, end_date, aggregate_week, deaths):
     data = (data.reindex(pd.date_range(start_date, end_date_hosp, freq='D'))
             .rename_axis('date')
             .interpolate())
-    data['hospitalization'] = data['value'].diff()
-    data['hospitalization'][0] = 0
-
-    values = []
-    for line, (index, row) in enumerate(data.iterrows()):
-        if line < 7:
-            values.append(row['hospitalization'] + data['value'][0]/7)
-        else:
-            values.append(row['hospitalization'] + values[line - 7])
-
-    data['test'] = list(pd.Series(values)[::-1].rolling(window=7).sum()[::-1])
-    data['daily'] = values
+
+    data['daily'] = weekly_to_daily(data['value'].to_numpy())
     data = data.loc[start_date:end_date]
 
     hospitalization = data['daily']
+    if aggregate_week:
+        cases = cases.groupby(pd.Grouper(freq='W-MON')).sum()
+        hospitalization = hospitalization.groupby(pd.Grouper(freq='W-MON')).sum()
 
     return cases, hospitalization
 
+
+def weekly_to_daily(weekly):
+    # Solves daily[t] = weekly[t] - weekly[t-1] + daily[t-7], starting from weekly[0] / 7,
+    # as a cumulative sum over the 7 interleaved day-of-week subsequences
+    size = len(weekly)
+    diff = np.zeros(-(-size // 7) * 7)
+    diff[1:size] = np.diff(weekly)
+    diff[:7] += weekly[0] / 7
+    return np.cumsum(diff.reshape(-1, 7), axis=0).ravel()[:size]
+
+
+if __name__ == '__main__':
+    build_spanish_cache()
@@ -0,0 +1,99 @@
+import json
+import os
+
+import numpy as np
+import pymc as pm
+from pymc.step_methods.hmc.quadpotential import QuadPotentialDiagAdapt
+
+from result_store import load_result, result_groups, result_path
+
+
+WARM_START_DIR = 'results/warm_start'
+
+# Weight, in draws, given to the stored mass matrix when adaptation resumes
+WARM_START_WEIGHT = 100
+
+
+def warm_start_path(kind, region, n_switchpoints):
+    return os.path.join(WARM_START_DIR, f'{kind}_{n_switchpoints}_{region}.json')
+
+
+def save_warm_start(kind, region, n_switchpoints, model, idata):
+    # Needs the sampler run with include_transformed=True; the transformed
+    # variables are dropped from idata once the mass matrix is estimated from them
+    posterior = idata.posterior
+    dims = ('chain', 'draw')
+    state = {
+        'initvals': {rv.name: posterior[rv.name].median(dim=dims).to_numpy().tolist()
+                     for rv in model.free_RVs if rv.name in posterior}
+    }
+
+    value_names = [var.name for var in model.continuous_value_vars]
+    if all(name in posterior for name in value_names):
+        state['mean'] = {name: posterior[name].mean(dim=dims).to_numpy().tolist()
+                         for name in value_names}
+        state['variance'] = {name: posterior[name].var(dim=dims).to_numpy().tolist()
+                             for name in value_names}
+
+    if 'sample_stats' in idata and 'step_size' in idata.sample_stats:
+        state['step_size'] = float(idata.sample_stats['step_size'].isel(draw=-1).mean())
+
+    os.makedirs(WARM_START_DIR, exist_ok=True)
+    with open(warm_start_path(kind, region, n_switchpoints), 'w') as file:
+        json.dump(state, file)
+
+    idata.posterior = posterior.drop_vars([name for name in posterior.data_vars if name.endswith('__')])
+
+
+def load_warm_start(kind, region, n_switchpoints, model, step, tune, warm_tune,
+                    target_accept=0.8):
+    # Returns the initial values, NUTS step and number of tuning draws to use:
+    # unchanged if nothing was stored for this region, model and K
+    path = warm_start_path(kind, region, n_switchpoints)
+    if not os.path.exists(path):
+        return None, step, tune
+
+    with open(path) as file:
+        state = json.load(file)
+
+    initvals = {name: np.asarray(value) for name, value in state['initvals'].items()}
+
+    # Tuning is only shortened when the adaptation itself can be resumed
+    if 'variance' in state and 'step_size' in state:
+        value_vars = model.continuous_value_vars
+        mean = np.concatenate([np.ravel(state['mean'][var.name]) for var in value_vars])
+        variance = np.concatenate([np.ravel(state['variance'][var.name]) for var in value_vars])
+        potential = QuadPotentialDiagAdapt(len(variance), mean, np.maximum(variance, 1e-8),
+                                           WARM_START_WEIGHT)
+        # NUTS divides step_scale by n ** (1 / 4) to get its initial step size. The
+        # step carries target_accept, so callers must not pass it to pm.sample too
+        # (sampling.sample_kwargs leaves it out when given a step)
+        with model:
+            step = pm.NUTS(vars=value_vars, potential=potential, target_accept=target_accept,
+                           step_scale=state['step_size'] * len(variance) ** 0.25)
+        tune = min(tune, warm_tune)
+
+    return initvals, step, tune
+
+
+def seed_warm_start(kind, region, n_switchpoints, result_name):
+    # Starts the store from an earlier stored run: the medians and step size can
+    # be recovered from it, the mass matrix cannot (no transformed draws)
+    path = warm_start_path(kind, region, n_switchpoints)
+    if os.path.exists(path) or not os.path.exists(result_path(result_name)):
+        return
+
+    posterior = load_result(result_name, 'posterior')
+    dims = ('chain', 'draw')
+    state = {
+        'initvals': {name: posterior[name].median(dim=dims).to_numpy().tolist()
+                     for name in posterior.data_vars if not name.endswith('__')}
+    }
+    if 'sample_stats' in result_groups(result_name):
+        sample_stats = load_result(result_name, 'sample_stats')
+        if 'step_size' in sample_stats:
+            state['step_size'] = float(sample_stats['step_size'].isel(draw=-1).mean())
+
+    os.makedirs(WARM_START_DIR, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(state, file)
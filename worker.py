@@ -0,0 +1,141 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import time
+import traceback
+import uuid
+
+from parser import parse_args
+
+
+# Jobs are files in a spool directory: {name}.job when queued, renamed to
+# {name}.{pid}.running when the worker with that pid takes it and to .done or
+# .failed when it ends, with the job's output in {name}.log
+SPOOL_DIR = 'results/queue'
+POLL_INTERVAL = 0.2
+
+# Loaded once when the worker starts, so jobs start without the import cost
+WARM_MODULES = ('main', 'train', 'train_deaths', 'train_joint', 'train_hierarchical', 'model_selection')
+
+
+def job_path(spool, name, status):
+    return os.path.join(spool, f'{name}.{status}')
+
+
+def submit(argv, spool=SPOOL_DIR):
+    # Arguments are checked here, so a bad job fails at once instead of in the worker
+    parse_args(argv)
+    os.makedirs(spool, exist_ok=True)
+    name = f'{time.strftime("%Y%m%d_%H%M%S")}_{uuid.uuid4().hex[:8]}'
+    with open(job_path(spool, name, 'tmp'), 'w') as file:
+        json.dump({'args': argv}, file)
+    # Atomic, so a worker never reads a half-written job
+    os.rename(job_path(spool, name, 'tmp'), job_path(spool, name, 'job'))
+    return name
+
+
+def wait(name, spool=SPOOL_DIR):
+    while True:
+        for status in ('done', 'failed'):
+            if os.path.exists(job_path(spool, name, status)):
+                with open(job_path(spool, name, 'log')) as file:
+                    print(file.read(), end='')
+                return status == 'done'
+        time.sleep(POLL_INTERVAL)
+
+
+def running_status(pid=None):
+    return f'{pid or os.getpid()}.running'
+
+
+def claim(spool):
+    # Oldest job first. Only one of several workers sharing the spool can rename a job.
+    for path in sorted(glob.glob(job_path(spool, '*', 'job'))):
+        name = os.path.basename(path)[:-len('.job')]
+        try:
+            os.rename(path, job_path(spool, name, running_status()))
+        except FileNotFoundError:
+            continue
+        return name
+    return None
+
+
+def fail_stale_jobs(spool):
+    # Jobs left running by a worker that no longer exists (killed, or out of
+    # memory) are marked failed rather than re-queued, as they may kill the
+    # next worker the same way
+    for path in glob.glob(job_path(spool, '*', 'running')):
+        name, pid = os.path.basename(path)[:-len('.running')].rsplit('.', 1)
+        try:
+            os.kill(int(pid), 0)
+            continue
+        except PermissionError:
+            continue
+        except ProcessLookupError:
+            pass
+        with open(job_path(spool, name, 'log'), 'a') as log:
+            log.write(f'\nWorker {pid} stopped before the job finished\n')
+        os.rename(path, job_path(spool, name, 'failed'))
+        print(f'{name} failed: worker {pid} stopped before it finished')
+
+
+def run_job(args):
+    # As main.py, except that the regions run one after another in this process:
+    # each keeps the models compiled by the previous ones (reuse_model)
+    from main import run_joint, run_region
+
+    if args.joint:
+        run_joint(args.regions or [args.region], args)
+    else:
+        for region in args.regions or [args.region]:
+            run_region(region, args, reuse_model=True)
+
+
+def serve(spool=SPOOL_DIR):
+    for module in WARM_MODULES:
+        __import__(module)
+    os.makedirs(spool, exist_ok=True)
+    fail_stale_jobs(spool)
+    print(f'Waiting for jobs in {spool}')
+
+    while True:
+        name = claim(spool)
+        if name is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        with open(job_path(spool, name, running_status())) as file:
+            job = json.load(file)
+        print(f'Running {name}: {" ".join(job["args"])}')
+        start = time.perf_counter()
+        status = 'done'
+        with open(job_path(spool, name, 'log'), 'w') as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                run_job(parse_args(job['args']))
+            except (Exception, SystemExit):  # SystemExit: arguments argparse rejects
+                traceback.print_exc()
+                status = 'failed'
+        os.rename(job_path(spool, name, running_status()), job_path(spool, name, status))
+        print(f'{name} {status} in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(allow_abbrev=False,
+                                     usage='%(prog)s [--spool DIR] [--submit [--wait] MAIN_ARGS...]')
+    parser.add_argument("--spool", type=str, default=SPOOL_DIR)
+    parser.add_argument("--submit", default=False, action=argparse.BooleanOptionalAction,
+                        help="Queue a job with the remaining arguments (as for main.py) instead of serving")
+    parser.add_argument("--wait", default=False, action=argparse.BooleanOptionalAction,
+                        help="With --submit, wait for the job and print its output")
+    args, job_args = parser.parse_known_args()
+
+    if args.submit:
+        name = submit(job_args, args.spool)
+        print(name)
+        if args.wait and not wait(name, args.spool):
+            raise SystemExit(1)
+    else:
+        serve(args.spool)